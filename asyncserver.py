@@ -0,0 +1,85 @@
+import asyncio
+
+import protocol
+from headlessgameserver import HeadlessGameServer
+from metrics import get_logger
+
+from config import *
+
+
+log = get_logger(__name__)
+
+
+class ServerProtocol(asyncio.DatagramProtocol):
+    '''Hands the datagrams received on the server endpoint to the game server'''
+    def __init__(self, server):
+        self.server = server
+
+    def connection_made(self, transport):
+        # the transport has the same sendto(data, address) as the threaded server's socket
+        self.server.socket = transport
+        log.info("starting server at %s:%d", *transport.get_extra_info('sockname')[:2])
+
+    def datagram_received(self, data, address):
+        try:
+            self.server.parse_data(data, address)
+        except protocol.ProtocolError:
+            # drop anything that is not a valid datagram
+            pass
+
+    def error_received(self, exc):
+        # a client went away and the os reports the port as unreachable (ConnectionResetError
+        # on windows, ConnectionRefusedError on linux). The transport keeps working and the
+        # player is kicked once it has been inactive for INACTIVE_TIME, so just note it
+        log.debug('socket error: %s', exc)
+
+
+class AsyncGameServer(HeadlessGameServer):
+    '''The hide-and-seek game server running on a single asyncio event loop
+
+    Receiving packets, the simulation tick and the client updates are all
+    handled on one thread, so there are no threads competing for the players
+    or the GIL. The game rules are the same as HeadlessGameServer's.'''
+    def __init__(self):
+        '''Setup the server and Game'''
+        HeadlessGameServer.__init__(self)
+        # the datagram transport takes the place of the threaded server's socket
+        self.socket.close()
+        self.socket = None
+
+    def run(self, address=None):
+        '''Bind the server and run it until the game is done'''
+        asyncio.run(self.serve(address or self.bind_address()))
+
+    async def serve(self, address):
+        '''Open the UDP endpoint and run the tick and broadcast loops'''
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(lambda: ServerProtocol(self), local_addr=address)
+        self.start_stats()
+        try:
+            await asyncio.gather(self.tick_loop(), self.broadcast_loop())
+        finally:
+            transport.close()
+
+    async def tick_loop(self):
+        '''Run the simulation at TICK_RATE, the coroutine version of main_loop'''
+        # waiting for players to join to start the game
+        self.state = "waiting"
+        self.reset_tick = self.timestep.tick
+
+        while not self.done:
+            await asyncio.sleep(self.timestep.run(self.tick))
+            self.check_budget()
+            self.report_stats()
+
+    async def broadcast_loop(self):
+        '''Send gamestate information to all clients at BROADCAST_RATE, the coroutine version of notify_clients'''
+        loop = asyncio.get_running_loop()
+        next_update = loop.time()
+        while not self.done:
+            for _ in self.iter_broadcast():
+                # let the tick and incoming packets run in between clients
+                await asyncio.sleep(0)
+            # schedule against the ideal times so a slow broadcast doesn't push the rest back
+            next_update = max(next_update + 1/BROADCAST_RATE, loop.time())
+            await asyncio.sleep(next_update - loop.time())
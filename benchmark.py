@@ -0,0 +1,848 @@
+# performance checks for the game hot paths
+# run with: python benchmark.py
+# or only some of them: python benchmark.py protocol lobby
+# the microbenchmark suite: python benchmark.py --suite --json results.json [--compare baseline.json]
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import platform
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+from collision import Walls
+from game import Game
+from mapmaker import Maze
+from player import Player
+import protocol
+from snapshots import take_snapshot, delta, SnapshotHistory
+from headlessgameserver import HeadlessGameServer, ConnectedPlayer
+from registry import PlayerRegistry
+from asyncserver import AsyncGameServer
+from lobby import Lobby
+from timestep import FixedTimestep
+from interpolation import InterpolationBuffer
+from rewind import PositionHistory
+
+from config import *
+
+
+def loop_wallcollide(step_vector, walls):
+    '''The original per-wall Player.wallcollide loop, kept as the baseline to compare against'''
+    x1,y1,x2,y2 = step_vector
+    for wall in walls:
+        x3,y3,x4,y4 = wall
+
+        denom = np.linalg.det([[x1-x2,x3-x4],[y1-y2,y3-y4]])
+        if denom == 0: # parallel or coincedent
+            continue
+
+        t = np.linalg.det([[x1-x3,x3-x4],[y1-y3,y3-y4]]) / denom
+        u = -np.linalg.det([[x1-x2,x1-x3],[y1-y2,y1-y3]]) / denom
+
+        if 0 < t <= 1 and 0 <= u <= 1:
+            return True
+
+    return False
+
+
+def random_steps(count, seed=0, size=1000, speed=10):
+    '''Make a list of random player steps (x1,y1,x2,y2) on a grid of integer positions'''
+    myrandom = random.Random(seed)
+    steps = []
+    for _ in range(count):
+        x, y = myrandom.randint(-50, size), myrandom.randint(-50, size)
+        dx, dy = myrandom.choice([(speed,0),(-speed,0),(0,speed),(0,-speed),(speed,speed),(-speed,speed)])
+        steps.append([x, y, x+dx, y+dy])
+    return steps
+
+
+def timeit(func, repeat):
+    '''Return the mean time in seconds of calling func repeat times'''
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_wallcollide(players=100):
+    '''Compare the per-wall loop against the vectorized single and batched checks'''
+    maze = Maze(20, 20, 10, 10)
+    maze.make_maze(1)
+    wall_list = maze.get_wall_list(merge=False)
+    walls = Walls(wall_list)
+    steps = random_steps(players)
+
+    # the vectorized engine must agree with the original loop on every step
+    expected = [loop_wallcollide(s, wall_list) for s in steps]
+    assert [walls.collide(s) for s in steps] == expected
+    assert walls.collide_many(steps).tolist() == expected
+
+    loop = timeit(lambda: [loop_wallcollide(s, wall_list) for s in steps], 1)
+    single = timeit(lambda: [walls.collide(s) for s in steps], 5)
+    batch = timeit(lambda: walls.collide_many(steps), 20)
+    print('wallcollide: %d walls, %d players' % (len(walls), players))
+    print('  loop:    %8.3f ms per tick' % (loop*1000))
+    print('  single:  %8.3f ms per tick' % (single*1000))
+    print('  batched: %8.3f ms per tick' % (batch*1000))
+
+
+def bench_wall_grid(sizes=(20, 40, 80), players=100):
+    '''Compare testing every wall against the grid broad phase as the map grows'''
+    print('wall grid: %d players' % players)
+    for size in sizes:
+        maze = Maze(size, size, size//2, size//2)
+        maze.make_maze(1)
+        walls = Walls(maze.get_wall_list())
+        steps = np.array(random_steps(players, size=size*50))
+
+        # the grid must find exactly the same collisions as the full test
+        assert (walls.collide_many(steps) == walls.intersect(steps)).all()
+
+        brute = timeit(lambda: walls.intersect(steps), 10)
+        grid = timeit(lambda: walls.collide_many(steps), 10)
+        print('  MAP_SIZE %4d, %6d walls: all walls %8.3f ms, grid %8.3f ms per tick' % (size, len(walls), brute*1000, grid*1000))
+
+
+def bench_wall_merge(seeds=(1, 2, 3)):
+    '''Check that merged walls block exactly the same moves as one wall per cell edge'''
+    print('wall merge:')
+    for seed in seeds:
+        maze = Maze(20, 20, 10, 10)
+        maze.make_maze(seed)
+        original = maze.get_wall_list(merge=False)
+        merged = maze.get_wall_list()
+
+        # every move at every speed from a 5px lattice of positions covering the map
+        points = np.arange(-60, 1010, 5)
+        x, y = [a.ravel() for a in np.meshgrid(points, points)]
+        moves = 0
+        for speed in (HIDER_SPEED, SEEKER_SPEED, GHOST_SPEED):
+            for dx, dy in [(1,0),(-1,0),(0,1),(0,-1),(1,1),(-1,1),(1,-1),(-1,-1)]:
+                steps = np.stack([x, y, x+dx*speed, y+dy*speed], axis=1)
+                assert (Walls(original).collide_many(steps) == Walls(merged).collide_many(steps)).all()
+                moves += len(steps)
+
+        list_bytes = sys.getsizeof(original) + sum(sys.getsizeof(w) for w in original)
+        print('  seed %d: %d walls -> %d merged, %d bytes -> %d bytes (%s), %d moves agree' %
+              (seed, len(original), len(merged), list_bytes, merged.nbytes, merged.dtype, moves))
+
+
+def bench_make_maze(sizes=(20, 100, 500)):
+    '''Time generating the maze and its wall list as MAP_SIZE grows'''
+    print('make_maze:')
+    for size in sizes:
+        maze = Maze(size, size, size//2, size//2)
+        make = timeit(lambda: maze.make_maze(1), 1)
+        walls = timeit(maze.get_wall_list, 1)
+        print('  MAP_SIZE %4d: make_maze %8.1f ms, get_wall_list %8.1f ms' % (size, make*1000, walls*1000))
+
+
+def make_players(count, seed=0):
+    '''Make server-side players spread around the map'''
+    myrandom = random.Random(seed)
+    players = []
+    for i in range(count):
+        player = ConnectedPlayer([myrandom.uniform(0, 1000), myrandom.uniform(0, 1000)], 'player%d' % i, ('127.0.0.1', 20000 + i))
+        player.id = i
+        player.role = myrandom.choice([HIDER_ROLE, SEEKER_ROLE, GHOST_ROLE])
+        player.inputs = 1 << myrandom.choice(ARROW_KEYS)
+        player.last_active = 0
+        player.received_inputs = (0, player.inputs)
+        players.append(player)
+    return players
+
+
+def update_message(players, baseline=None):
+    '''Build the update dict that notify_clients sends, a full snapshot unless a baseline snapshot is given'''
+    changed, removed = delta(baseline or {}, take_snapshot(players))
+    return {'type': 'update', 'baseline': -1 if baseline is None else 0, 'players': changed, 'local': [],
+            'removed': removed, 'hidden': [], 'game_state': 'seeking', 'map_seed': 1, 'next_map_seed': 2,
+            'timestamp': 1000, 'ack_seq': 12, 'ack_ticks': 3}
+
+
+def bench_protocol(counts=(2, 10, 40)):
+    '''Compare the size and encode/decode time of a pickled update against the binary protocol'''
+    print('update packet:')
+    for count in counts:
+        players = make_players(count)
+        message = update_message(players)
+        pickled = pickle.dumps({'type': 'update', 'players': players, 'game_state': 'seeking',
+                                'map_seed': 1, 'next_map_seed': 2, 'timestamp': 1000})
+        packed = protocol.encode(message)
+        pickle_encode = timeit(lambda: pickle.dumps({'type': 'update', 'players': players}), 200)
+        pickle_decode = timeit(lambda: pickle.loads(pickled), 200)
+        packed_encode = timeit(lambda: protocol.encode(message), 200)
+        packed_decode = timeit(lambda: protocol.decode(packed), 200)
+        print('  %3d players: pickle %6d bytes, %7.1f us encode, %7.1f us decode' %
+              (count, len(pickled), pickle_encode*1e6, pickle_decode*1e6))
+        print('               binary %6d bytes, %7.1f us encode, %7.1f us decode' %
+              (len(packed), packed_encode*1e6, packed_decode*1e6))
+
+
+def bench_delta(counts=(10, 40, 100), updates=50, moving=0.5):
+    '''Compare the bytes of sending full snapshots against deltas on the previous update
+
+    a fraction of the players move every update, the rest stand still'''
+    print('delta updates: %d updates, %d%% of players moving' % (updates, moving*100))
+    for count in counts:
+        players = make_players(count)
+        full_bytes = delta_bytes = 0
+        baseline = None
+        for _ in range(updates):
+            for player in players[:int(count*moving)]:
+                player.location = [player.location[0] + HIDER_SPEED*3, player.location[1]]
+            full_bytes += len(protocol.encode(update_message(players)))
+            delta_bytes += len(protocol.encode(update_message(players, baseline)))
+            baseline = take_snapshot(players)
+        print('  %3d players: full %7.0f bytes/update, delta %7.0f bytes/update (%.1fx smaller)' %
+              (count, full_bytes/updates, delta_bytes/updates, full_bytes/delta_bytes))
+
+
+class CountingSocket:
+    '''Stands in for the server socket, counting the datagrams and bytes sent to each address'''
+    def __init__(self):
+        self.sent = {}
+
+    def sendto(self, data, address):
+        count, size = self.sent.get(address, (0, 0))
+        self.sent[address] = (count + 1, size + len(data))
+
+
+def bench_interest(counts=(50, 200, 800), updates=20, density=40):
+    '''Measure bytes and time per client for a lobby with the same player density on a growing map
+
+    density is the number of players per screen-sized area'''
+    print('area of interest: %d updates, %d players per screen' % (updates, density))
+    server = HeadlessGameServer()
+    for count in counts:
+        side = (count / density * SCREEN_SIZE[0] * SCREEN_SIZE[1]) ** 0.5
+        players = make_players(count)
+        for player in players:
+            player.location = [random.uniform(0, side), random.uniform(0, side)]
+            player.acked_timestamp = None
+            player.views = SnapshotHistory()
+        server.players = players
+        server.history = SnapshotHistory()
+        server.socket = CountingSocket()
+
+        start = time.perf_counter()
+        for timestamp in range(updates+1):
+            if timestamp == 1:
+                # leave out the first update, the full snapshot every new client gets
+                server.socket = CountingSocket()
+                start = time.perf_counter()
+            server.send_updates(timestamp)
+            for player in players:
+                # every client acknowledges every update and hiders keep moving
+                player.acked_timestamp = timestamp
+                player.location = [player.location[0] + HIDER_SPEED*3, player.location[1]]
+        elapsed = time.perf_counter() - start
+
+        datagrams = sum(c for c, _ in server.socket.sent.values())
+        size = sum(s for _, s in server.socket.sent.values())
+        print('  %4d players: %6.0f bytes per client per update, %5.2f datagrams, %6.1f us per client' %
+              (count, size / count / updates, datagrams / count / updates, elapsed / count / updates * 1e6))
+
+
+def bench_registry(counts=(100, 1000, 5000)):
+    '''Time parse_data for a login and an inputs packet from every player, against scanning a player list
+
+    the list scan is how parse_data found the sender of a packet before the registry'''
+    print('player registry:')
+    server = HeadlessGameServer()
+    for count in counts:
+        server.players = PlayerRegistry()
+        server.socket = CountingSocket()
+        addresses = [('10.0.%d.%d' % (i // 250, i % 250), 20000 + i) for i in range(count)]
+        logins = [protocol.encode({'type': 'login', 'username': 'player%d' % i, 'timestamp': 1}) for i in range(count)]
+        inputs = protocol.encode({'type': 'inputs', 'inputs': 1 << UP_KEY, 'seq': 1, 'timestamp': 2})
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            for data, address in zip(logins, addresses):
+                server.parse_data(data, address)
+            login = (time.perf_counter() - start) / count
+            start = time.perf_counter()
+            for address in addresses:
+                server.parse_data(inputs, address)
+            packet = (time.perf_counter() - start) / count
+        assert len(server.players) == count
+
+        players = list(server.players)
+        sample = addresses[::max(1, count // 200)]
+        start = time.perf_counter()
+        for address in sample:
+            [x for x in players if x.address == address]
+        scan = (time.perf_counter() - start) / len(sample)
+        print('  %5d players: login %6.1f us, inputs packet %6.1f us, list scan lookup alone %8.1f us' %
+              (count, login*1e6, packet*1e6, scan*1e6))
+
+
+def flood(address, bots, duration):
+    '''Log in some bots and send inputs packets from them as fast as possible
+
+    the bots acknowledge the updates they get like the real client, so the
+    server sends them deltas'''
+    sockets = []
+    for i in range(bots):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.sendto(protocol.encode({'type': 'login', 'username': 'bot%d' % i, 'timestamp': 0}), address)
+        sockets.append((sock, protocol.Reassembler()))
+    time.sleep(0.2)
+    end = time.time() + duration
+    timestamp = 1
+    while time.time() < end:
+        for i, (sock, reassembler) in enumerate(sockets):
+            inputs = 1 << (timestamp + i) % 4
+            sock.sendto(protocol.encode({'type': 'inputs', 'inputs': inputs, 'seq': timestamp, 'timestamp': timestamp}), address)
+            while True:
+                try:
+                    data = protocol.decode(sock.recv(MAX_PACKET))
+                except BlockingIOError:
+                    break
+                if data['type'] == 'fragment':
+                    data = reassembler.add(data)
+                    data = data and protocol.decode(data)
+                if data and data['type'] == 'update':
+                    sock.sendto(protocol.encode({'type': 'update_ack', 'ack': data['timestamp'], 'timestamp': timestamp}), address)
+        timestamp += 1
+
+
+def run_engine(engine, bots, duration):
+    '''Run a server engine on localhost under an inputs flood
+
+    returns the packets handled per second, how late each tick started in seconds, and the timestep'''
+    with contextlib.redirect_stdout(io.StringIO()):
+        if engine == 'asyncio':
+            server = AsyncGameServer()
+        else:
+            server = HeadlessGameServer()
+        handled = [0]
+        ticks = []
+        parse_data, tick = server.parse_data, server.tick
+        def counting_parse_data(data, address):
+            handled[0] += 1
+            parse_data(data, address)
+        def timed_tick(number):
+            # lateness against the tick's ideal start time
+            ticks.append(time.perf_counter() - server.timestep.start - number*server.timestep.dt)
+            tick(number)
+        server.parse_data, server.tick = counting_parse_data, timed_tick
+
+        if engine == 'asyncio':
+            thread = threading.Thread(target=server.run, args=(('127.0.0.1', 0),), daemon=True)
+            thread.start()
+            while server.socket is None:
+                time.sleep(0.01)
+            address = server.socket.get_extra_info('sockname')
+        else:
+            server.bind_address = lambda: ('127.0.0.1', 0)
+            server.setup_server()
+            address = server.socket.getsockname()
+            thread = threading.Thread(target=server.main_loop, daemon=True)
+            thread.start()
+
+        flooder = multiprocessing.Process(target=flood, args=(address, bots, duration))
+        flooder.start()
+        time.sleep(0.3)
+        start, start_count, start_ticks = time.perf_counter(), handled[0], len(ticks)
+        flooder.join()
+        rate = (handled[0] - start_count) / (time.perf_counter() - start)
+        server.done = True
+        thread.join(1)
+    return rate, np.array(ticks[start_ticks:]), server.timestep
+
+
+def bench_engines(bots=(10, 100), duration=2.0):
+    '''Compare the threaded and asyncio servers on packets handled and tick jitter under load'''
+    print('server engines (localhost inputs flood):')
+    for count in bots:
+        for engine in ('threaded', 'asyncio'):
+            rate, lateness, timestep = run_engine(engine, count, duration)
+            lateness = lateness * 1000
+            print('  %3d bots %-8s: %7.0f packets/s, ticks late %5.2f ms mean %6.2f ms p99, %d over budget, %d skipped' %
+                  (count, engine, rate, lateness.mean(), np.percentile(lateness, 99), timestep.overruns, timestep.skipped))
+
+
+def lobby_bots(address, bots, duration, rates):
+    '''Log bots in through the lobby, then count the updates each one gets from its room
+
+    rates gets the updates per second of every bot'''
+    sockets = []
+    for i in range(bots):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        sock.sendto(protocol.encode({'type': 'login', 'username': 'bot%d' % i, 'timestamp': 0}), address)
+        sockets.append([sock, protocol.Reassembler(), 0])
+
+    start = time.time()
+    counting = start + 2
+    while time.time() < counting + duration:
+        now = time.time()
+        for i, bot in enumerate(sockets):
+            sock, reassembler = bot[0], bot[1]
+            while True:
+                try:
+                    data, sender = sock.recvfrom(MAX_PACKET)
+                except BlockingIOError:
+                    break
+                data = protocol.decode(data)
+                if data['type'] == 'redirect':
+                    bot.append((sender[0], data['port']))
+                    sock.sendto(protocol.encode({'type': 'login', 'username': 'bot%d' % i, 'timestamp': 0}), bot[3])
+                    continue
+                if data['type'] == 'fragment':
+                    data = reassembler.add(data)
+                    data = data and protocol.decode(data)
+                if data and data['type'] == 'update':
+                    sock.sendto(protocol.encode({'type': 'update_ack', 'ack': data['timestamp'], 'timestamp': 1}), bot[3])
+                    # the first couple of seconds are for logging everyone in
+                    if now >= counting:
+                        bot[2] += 1
+        time.sleep(0.005)
+    for i, bot in enumerate(sockets):
+        rates[i] = bot[2] / duration
+
+
+def bench_lobby(rooms=(8, 32), players=2, duration=3.0, port=12000):
+    '''Run a lobby with rooms of two bots and measure how many of their 10 per second updates arrive
+
+    the rooms keep up as long as the workers have the cpu for them, so more
+    workers than cores doesn't help'''
+    cores = os.cpu_count() or 1
+    print('lobby rooms (%d players each, %d cores):' % (players, cores))
+    for count in rooms:
+        for workers in sorted({1, cores}):
+            with contextlib.redirect_stdout(io.StringIO()):
+                lobby = Lobby(count, players, workers)
+                lobby.bind_address = lambda: ('127.0.0.1', port)
+                lobby.setup_server()
+                threading.Thread(target=lobby.serve_forever, daemon=True).start()
+                time.sleep(1 + count * 0.02) # the rooms build their first maps
+                rates = multiprocessing.Array('d', count * players)
+                bots = multiprocessing.Process(target=lobby_bots, args=(('127.0.0.1', port), count * players, duration, rates))
+                bots.start()
+                bots.join()
+                for p in lobby.workers:
+                    p.terminate()
+                    p.join()
+            rates = np.array(rates[:])
+            print('  %3d rooms, %2d workers: %5.1f updates/s per player, %3d%% of players above 9/s' %
+                  (count, workers, rates.mean(), 100 * (rates > 9).mean()))
+            port += count + 1
+
+
+def bench_timestep(loads=(0.5, 0.9, 1.2), duration=2.0, rate=30):
+    '''Compare game time against wall time for the pygame clock loop and the fixed timestep
+
+    the ticks sleep for a random time averaging load times the tick budget;
+    the pygame clock waits a whole frame after every tick, so the game slows
+    down, while the fixed timestep catches up'''
+    import pygame
+    print('simulation loop (%d ticks/s):' % rate)
+    for load in loads:
+        random.seed(0)
+        def step(tick=None):
+            time.sleep(random.uniform(0, 2*load/rate))
+
+        clock = pygame.time.Clock()
+        ticks = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            step()
+            ticks += 1
+            clock.tick(rate)
+        clock_speed = ticks / rate / (time.perf_counter() - start)
+
+        timestep = FixedTimestep(rate)
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            time.sleep(timestep.run(step))
+        fixed_speed = timestep.tick / rate / (time.perf_counter() - start)
+        print('  load %3.0f%%: game speed with pygame clock %4.2fx, with fixed timestep %4.2fx (%d over budget, %d skipped)' %
+              (load*100, clock_speed, fixed_speed, timestep.overruns, timestep.skipped))
+
+
+def remote_path(ticks, seed=0, speed=GHOST_SPEED):
+    '''Positions of a remote player changing direction every half second'''
+    myrandom = random.Random(seed)
+    path = [(0.0, 0.0)]
+    for tick in range(1, ticks):
+        if tick % (TICK_RATE // 2) == 1:
+            direction = myrandom.choice([(1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (0, 0)])
+        path.append((path[-1][0] + direction[0]*speed, path[-1][1] + direction[1]*speed))
+    return path
+
+
+def bench_interpolation(rates=(5, 10, 20), seconds=20, loss=0.1, latency=0.05, jitter=0.02, fps=60):
+    '''Compare drawing remote players from the interpolation buffer against snapping them to each update
+
+    The snapping client also moves the players along their last inputs every
+    tick, like the client did before. Updates come at the broadcast rate with
+    some loss and jitter, and frames are drawn at fps. Reports how far the
+    drawn position is from the true one (the true one INTERPOLATION_DELAY ago
+    for the buffer) and how much the movement between frames jerks compared
+    to the true movement.'''
+    print('remote player interpolation (%d%% loss, %d+-%d ms latency, %d fps):' % (loss*100, latency*1000, jitter*1000, fps))
+    path = remote_path(seconds * TICK_RATE)
+    for rate in rates:
+        myrandom = random.Random(1)
+        # (arrival time, tick) of each update that made it
+        arrivals = sorted((tick / TICK_RATE + latency + myrandom.uniform(-jitter, jitter), tick)
+                          for tick in range(0, len(path), TICK_RATE // rate) if myrandom.random() > loss)
+        now = [0.0]
+        delay = 2 / rate
+        buffer = InterpolationBuffer(delay=delay, clock=lambda: now[0])
+
+        results = {}
+        for method in ('snap', 'interpolate'):
+            errors, jerks = [], []
+            previous = None
+            received = 0
+            snapped = None
+            for frame in range(int((seconds - 1) * fps)):
+                now[0] = frame / fps
+                while received < len(arrivals) and arrivals[received][0] <= now[0]:
+                    tick = arrivals[received][1]
+                    if method == 'snap':
+                        velocity = (path[min(tick+1, len(path)-1)][0] - path[tick][0], path[min(tick+1, len(path)-1)][1] - path[tick][1])
+                        snapped = (path[tick], tick, now[0], velocity)
+                    elif received == 0 or tick > arrivals[received-1][1]:
+                        buffer.add(tick, {0: path[tick]})
+                    received += 1
+                if method == 'snap':
+                    if snapped is None:
+                        continue
+                    # moved along its last inputs once per client tick since the update arrived
+                    (x, y), tick, arrived, velocity = snapped
+                    steps = int(now[0] * TICK_RATE) - int(arrived * TICK_RATE)
+                    position = (x + velocity[0]*steps, y + velocity[1]*steps)
+                    true_tick = now[0] * TICK_RATE
+                else:
+                    position = buffer.position(0, buffer.render_tick())
+                    if position is None:
+                        continue
+                    true_tick = (now[0] - delay - latency) * TICK_RATE
+                true_tick = min(max(true_tick, 0), len(path) - 1)
+                low = int(true_tick)
+                high = min(low + 1, len(path) - 1)
+                truth = (path[low][0] + (path[high][0]-path[low][0])*(true_tick-low),
+                         path[low][1] + (path[high][1]-path[low][1])*(true_tick-low))
+                errors.append(abs(position[0]-truth[0]) + abs(position[1]-truth[1]))
+                if previous is not None:
+                    jerks.append(abs((position[0]-previous[0][0]) - (truth[0]-previous[1][0])) +
+                                 abs((position[1]-previous[0][1]) - (truth[1]-previous[1][1])))
+                previous = (position, truth)
+            results[method] = (np.mean(errors), np.mean(jerks), np.percentile(jerks, 99))
+        print('  %2d updates/s: snap error %5.1f px jerk %5.1f px/frame (p99 %5.1f), interpolated error %5.1f px jerk %5.1f px/frame (p99 %5.1f)' %
+              ((rate,) + results['snap'] + results['interpolate']))
+
+
+def bench_rewind(rtts=(0.05, 0.1, 0.2, 0.4), trials=200, counts=(100, 1000)):
+    '''Count the catches of seekers touching a hider where their screen shows it, with and without rewinding
+
+    the hider runs in a random direction; the seeker ends up within a few
+    pixels of where the hider was rtt + INTERPOLATION_DELAY ago, which is where
+    its screen drew the hider. Also times recording the positions each tick.'''
+    print('lag compensation (hider running at %d px/tick):' % HIDER_SPEED)
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = HeadlessGameServer()
+    myrandom = random.Random(0)
+    for rtt in rtts:
+        caught = {'now': 0, 'rewound': 0}
+        for _ in range(trials):
+            hider, seeker = make_players(2, myrandom.randrange(1 << 30))
+            hider.role, seeker.role = HIDER_ROLE, SEEKER_ROLE
+            seeker.rtt = rtt
+            server.players = [hider, seeker]
+            server.positions = PositionHistory()
+            angle = myrandom.uniform(0, 2*np.pi)
+            lag = int(round((rtt + INTERPOLATION_DELAY) * TICK_RATE))
+            path = lambda tick: [500 + np.cos(angle)*HIDER_SPEED*tick, 500 + np.sin(angle)*HIDER_SPEED*tick]
+            for tick in range(60):
+                hider.location = path(tick)
+                server.positions.record(tick, server.players)
+            seen = path(59 - lag)
+            seeker.location = [seen[0] + myrandom.uniform(-10, 10), seen[1] + myrandom.uniform(-10, 10)]
+            server.positions.record(59, server.players)
+            server.index_players()
+            caught['rewound'] += bool(server.get_caught_rewound(seeker, 59))
+            caught['now'] += bool(server.get_caught(seeker))
+        print('  rtt %3d ms: caught %3d%% without rewinding, %3d%% rewinding %d ticks' %
+              (rtt*1000, 100*caught['now']/trials, 100*caught['rewound']/trials, server.rewind_ticks(seeker)))
+    for count in counts:
+        players = make_players(count)
+        history = PositionHistory()
+        record = timeit(lambda: history.record(0, players), 20)
+        print('  %4d players: record a tick %6.1f us, history %5d KB' % (count, record*1e6, history.positions.nbytes // 1024))
+
+
+def bench_startup(modules=('pygame', 'numpy', 'headlessgameserver', 'asyncserver', 'lobby', 'loadtest', 'visualgame'), runs=10):
+    '''Time starting a fresh python and importing a module, like a room worker or a bot process does
+
+    shows whether the module pulled in pygame. pygame and numpy are there to
+    compare against, the server modules shouldn't cost much more than numpy.'''
+    print('cold start (median of %d fresh interpreters):' % runs)
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = ('import sys, time; start = time.perf_counter(); import %s; '
+            'print(time.perf_counter() - start, "pygame" in sys.modules)')
+    for module in modules:
+        totals, imports = [], []
+        for _ in range(runs):
+            start = time.perf_counter()
+            out = subprocess.run([sys.executable, '-c', code % module], capture_output=True, text=True, cwd=here,
+                                 env=dict(os.environ, PYGAME_HIDE_SUPPORT_PROMPT='1')).stdout.split()
+            totals.append(time.perf_counter() - start)
+            imports.append(float(out[-2]))
+        print('  %-20s %6.1f ms process, %6.1f ms import, pygame %s' %
+              (module, np.median(totals)*1000, np.median(imports)*1000, 'loaded' if out[-1] == 'True' else 'not loaded'))
+
+
+def scan_caught(server, seeker, tick):
+    '''The catch check before the spatial hash, testing every hider against the seeker'''
+    hiders = [player for player in server.players if player is not seeker and player.role == HIDER_ROLE]
+    seeker_rect = seeker.get_rect()
+    past = server.positions.get(tick - server.rewind_ticks(seeker), [player.id for player in hiders])
+    caught = []
+    for player, location in zip(hiders, past):
+        if np.isnan(location[0]):
+            location = player.location
+        if player.get_rect(location).colliderect(seeker_rect):
+            caught.append(player)
+    return caught
+
+
+def bench_catches(counts=(100, 1000, 5000), seeker_counts=(1, 10, 100), size=40):
+    '''Time finding the catches of every seeker in a tick, with the spatial hash against testing every hider
+
+    the players are spread over a size x size map, the seekers have a 100 ms
+    round trip so the hiders are rewound. Also times keeping the hash up to
+    date when everyone moves a step.'''
+    print('catches (players over a %dx%d map):' % (size, size))
+    with contextlib.redirect_stdout(io.StringIO()):
+        server = HeadlessGameServer()
+    for count in counts:
+        players = spread_players(count, size)
+        server.players = players
+        server.positions = PositionHistory()
+        for tick in range(MAX_REWIND_TICKS + 1):
+            server.positions.record(tick, players)
+        server.index_players()
+        for player in players:
+            player.rtt = 0.1
+        for step in (1, -1):
+            for player in players:
+                player.location = [player.location[0] + step*HIDER_SPEED, player.location[1]]
+            sync = timeit(server.index_players, 1)
+        for seekers in seeker_counts:
+            if seekers >= count:
+                continue
+            for i, player in enumerate(players):
+                player.role = SEEKER_ROLE if i < seekers else HIDER_ROLE
+            tick = MAX_REWIND_TICKS
+            hashed = measure(lambda: server.get_catches(tick), repeat=3)
+            scanned = measure(lambda: [scan_caught(server, seeker, tick) for seeker in players[:seekers]], repeat=3)
+            # the same catches either way
+            assert set(server.get_catches(tick)) == {p for seeker in players[:seekers] for p in scan_caught(server, seeker, tick)}
+            print('  %5d players %3d seekers: spatial hash %8.1f us, every hider %9.1f us (%5.1fx)' %
+                  (count, seekers, hashed*1e6, scanned*1e6, scanned/hashed))
+        print('  %5d players: syncing the hash after everyone moved %.1f us' % (count, sync*1e6))
+
+
+def measure(func, repeat=5, min_time=0.05):
+    '''Return the best time in seconds of one call to func
+
+    func is called in runs of enough calls to take min_time, and the fastest
+    of repeat runs is kept, so background noise only makes runs slower'''
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def make_map(size, seed=1):
+    '''Build the walls of a size x size maze'''
+    maze = Maze(size, size, size//2, size//2)
+    maze.make_maze(seed)
+    return Walls(maze.get_wall_list())
+
+
+def spread_players(count, size, seed=0):
+    '''Make hiders spread over a size x size maze, plus a seeker in the middle of them'''
+    myrandom = random.Random(seed)
+    players = make_players(count, seed)
+    for player in players:
+        player.location = [myrandom.uniform(0, size*CELL_SIZE), myrandom.uniform(0, size*CELL_SIZE)]
+        player.role = HIDER_ROLE
+        player.speed = HIDER_SPEED
+    players[0].role = SEEKER_ROLE
+    players[0].speed = SEEKER_SPEED
+    return players
+
+
+def suite(map_sizes=(10, 20, 40, 80), maze_sizes=(20, 50, 100, 200), player_counts=(10, 100, 1000, 5000),
+          payload_counts=(2, 10, 40, 100), draw_counts=(1, 10, 50)):
+    '''Time the simulation, map, protocol and drawing hot paths at several sizes
+
+    returns a list of {'name', 'params', 'seconds'} results, seconds per call'''
+    results = []
+    def record(name, params, seconds):
+        results.append({'name': name, 'params': params, 'seconds': seconds})
+        print('  %-24s %-28s %12.2f us' % (name, ', '.join('%s=%s' % item for item in params.items()), seconds*1e6))
+
+    print('microbenchmark suite:')
+    for size in map_sizes:
+        walls = make_map(size)
+        steps = random_steps(256, seed=size, size=size*CELL_SIZE)
+        player = Player([0, 0], 'bench')
+        player.role = HIDER_ROLE
+        step = iter(range(1 << 62))
+        def wallcollide():
+            player.wallcollide(steps[next(step) % len(steps)], walls)
+        record('Player.wallcollide', {'map_size': size}, measure(wallcollide))
+        player.inputs = 1 << RIGHT_KEY | 1 << DOWN_KEY
+        def update_location():
+            player.location = list(steps[next(step) % len(steps)][:2])
+            player.update_location(walls)
+        record('Player.update_location', {'map_size': size}, measure(update_location))
+
+    for count in player_counts:
+        with contextlib.redirect_stdout(io.StringIO()):
+            game = Game()
+        game.map = make_map(20)
+        game.players = spread_players(count, 20)
+        game.state = 'seeking'
+        record('Game.update', {'players': count}, measure(game.update))
+        record('Game.update_batched', {'players': count}, measure(game.update_batched))
+        record('Game.update_objects', {'players': count}, measure(game.update_objects))
+        record('Game.get_caught', {'players': count}, measure(lambda: game.get_caught(game.players[0])))
+
+    for size in maze_sizes:
+        # a maze can only be made once
+        record('Maze.make_maze', {'map_size': size}, measure(lambda: Maze(size, size, size//2, size//2).make_maze(1), repeat=3))
+        maze = Maze(size, size, size//2, size//2)
+        maze.make_maze(1)
+        record('Maze.get_wall_list', {'map_size': size}, measure(maze.get_wall_list, repeat=3))
+
+    for count in payload_counts:
+        players = make_players(count)
+        message = update_message(players)
+        # the update notify_clients used to pickle, and the binary protocol that replaced it
+        payload = {'type': 'update', 'players': players, 'game_state': 'seeking',
+                   'map_seed': 1, 'next_map_seed': 2, 'timestamp': 1000}
+        pickled = pickle.dumps(payload)
+        packed = protocol.encode(message)
+        record('pickle.dumps update', {'players': count}, measure(lambda: pickle.dumps(payload)))
+        record('pickle.loads update', {'players': count}, measure(lambda: pickle.loads(pickled)))
+        record('protocol.encode update', {'players': count}, measure(lambda: protocol.encode(message)))
+        record('protocol.decode update', {'players': count}, measure(lambda: protocol.decode(packed)))
+
+    # draw without a window
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    from visualgame import VisualGame
+    with contextlib.redirect_stdout(io.StringIO()):
+        client = VisualGame('bench')
+    client.map = make_map(MAP_SIZE)
+    for count in draw_counts:
+        # everyone around the middle of the map, on screen
+        players = make_players(count)
+        for player in players:
+            player.location = [MAP_CENTER[0] + player.location[0] % SCREEN_SIZE[0] - SCREEN_SIZE[0]/2,
+                               MAP_CENTER[1] + player.location[1] % SCREEN_SIZE[1] - SCREEN_SIZE[1]/2]
+        client.player = players[0]
+        client.players = players
+        record('VisualGame.draw', {'players': count}, measure(client.draw))
+    return results
+
+
+def suite_metadata():
+    '''Describe the commit and machine the suite ran on'''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    import pygame
+    return {'commit':   commit,
+            'time':     time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python':   platform.python_version(),
+            'numpy':    np.__version__,
+            'pygame':   pygame.version.ver,
+            'platform': platform.platform(),
+            'cpus':     os.cpu_count()}
+
+
+def compare(results, baseline, threshold):
+    '''Print how each result changed against a baseline run, returns the number of regressions'''
+    def key(result):
+        return result['name'], json.dumps(result['params'], sort_keys=True)
+    old = {key(result): result['seconds'] for result in baseline['results']}
+    print('against %s:' % (baseline['meta'].get('commit') or 'baseline'))
+    regressions = 0
+    for result in results:
+        before = old.get(key(result))
+        if before is None:
+            continue
+        ratio = result['seconds'] / before
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print('  %-24s %-28s %6.2fx%s' % (result['name'], ', '.join('%s=%s' % item for item in result['params'].items()), ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the game hot paths')
+    parser.add_argument('benches', nargs='*', help='only run these benchmarks, e.g. protocol lobby')
+    parser.add_argument('--suite', action='store_true', help='run the microbenchmark suite instead')
+    parser.add_argument('--json', help='write the suite results to this file')
+    parser.add_argument('--compare', help='compare the suite results against an earlier --json file')
+    parser.add_argument('--threshold', type=float, default=1.25, help='slowdown counted as a regression by --compare')
+    args = parser.parse_args()
+    # the servers warn when the floods push their ticks over budget, that is expected here
+    logging.disable(logging.WARNING)
+
+    if args.suite or args.json or args.compare:
+        results = suite()
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump({'meta': suite_metadata(), 'results': results}, f, indent=1)
+        if args.compare:
+            with open(args.compare) as f:
+                if compare(results, json.load(f), args.threshold):
+                    sys.exit(1)
+        return
+
+    benches = args.benches or ['wallcollide', 'wall_grid', 'wall_merge', 'make_maze', 'protocol', 'delta',
+                               'interpolation', 'interest', 'registry', 'rewind', 'catches', 'startup', 'timestep', 'engines', 'lobby']
+    for name in benches:
+        globals()['bench_' + name]()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,18 @@
+# the client's keyboard keys, kept out of config.py so the server doesn't need pygame
+import pygame
+
+from config import *
+
+# get the client arrow keys
+CLIENT_UP_KEY = pygame.K_UP
+CLIENT_DOWN_KEY = pygame.K_DOWN
+CLIENT_RIGHT_KEY = pygame.K_RIGHT
+CLIENT_LEFT_KEY = pygame.K_LEFT
+CLIENT_ARROW_KEYS = [CLIENT_UP_KEY, CLIENT_DOWN_KEY, CLIENT_RIGHT_KEY, CLIENT_LEFT_KEY]
+
+CLIENT_TO_PROTOCOL = {
+    CLIENT_UP_KEY:UP_KEY,
+    CLIENT_DOWN_KEY:DOWN_KEY,
+    CLIENT_RIGHT_KEY:RIGHT_KEY,
+    CLIENT_LEFT_KEY:LEFT_KEY
+}
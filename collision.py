@@ -0,0 +1,163 @@
+import numpy as np
+
+from config import CELL_SIZE
+
+
+class Walls:
+    '''A map's walls stored as one contiguous array for vectorized collision checks
+
+    Each wall is a row (x3,y3,x4,y4). The per-wall terms of the line-line
+    intersection are computed once when the map is built, so a step only has
+    to combine them with its own coordinates.
+
+    The walls are also bucketed into a uniform grid of cell_size squares so a
+    short step is only tested against the walls in the cells it touches.'''
+    def __init__(self, walls, cell_size=CELL_SIZE):
+        '''Build the wall array, precompute the wall direction vectors and the grid index'''
+        self.walls = np.array(walls, dtype=np.float64).reshape(-1, 4)
+        self.x3 = self.walls[:,0]
+        self.y3 = self.walls[:,1]
+        # x3-x4 and y3-y4 from the intersection formula
+        self.dx = self.walls[:,0] - self.walls[:,2]
+        self.dy = self.walls[:,1] - self.walls[:,3]
+
+        self.cell_size = cell_size
+        self.build_grid()
+
+    def __len__(self):
+        return len(self.walls)
+
+    def __iter__(self):
+        return iter(self.walls)
+
+    def build_grid(self):
+        '''Bucket every wall into each grid cell its bounding box overlaps
+
+        The buckets are stored as a padded (rows, cols, k) table of wall
+        indices, with -1 filling the unused slots of a cell.'''
+        if not len(self.walls):
+            self.origin = (0, 0)
+            self.table = np.full((1, 1, 1), -1, dtype=np.int64)
+            return
+
+        lo_x = np.minimum(self.walls[:,0], self.walls[:,2])
+        hi_x = np.maximum(self.walls[:,0], self.walls[:,2])
+        lo_y = np.minimum(self.walls[:,1], self.walls[:,3])
+        hi_y = np.maximum(self.walls[:,1], self.walls[:,3])
+        self.origin = (int(np.floor(lo_x.min() / self.cell_size)), int(np.floor(lo_y.min() / self.cell_size)))
+        cols = int(np.floor(hi_x.max() / self.cell_size)) - self.origin[0] + 1
+        rows = int(np.floor(hi_y.max() / self.cell_size)) - self.origin[1] + 1
+
+        cx0 = self.cell_x(lo_x, cols)
+        cx1 = self.cell_x(hi_x, cols)
+        cy0 = self.cell_y(lo_y, rows)
+        cy1 = self.cell_y(hi_y, rows)
+
+        # expand each wall into one (wall, cell) pair per overlapped cell
+        width = cx1 - cx0 + 1
+        counts = width * (cy1 - cy0 + 1)
+        wall = np.repeat(np.arange(len(self.walls)), counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cell = (cy0[wall] + within // width[wall]) * cols + cx0[wall] + within % width[wall]
+
+        # sort the pairs by cell and give each wall a slot within its cell
+        order = np.argsort(cell, kind='stable')
+        cell, wall = cell[order], wall[order]
+        starts = np.searchsorted(cell, np.arange(rows*cols))
+        slot = np.arange(len(cell)) - starts[cell]
+
+        table = np.full((rows*cols, slot.max()+1), -1, dtype=np.int64)
+        table[cell, slot] = wall
+        self.table = table.reshape(rows, cols, -1)
+
+    def cell_x(self, x, cols=None):
+        '''Get the grid column of x coordinates, clamped to the grid'''
+        cols = self.table.shape[1] if cols is None else cols
+        cx = np.floor(np.asarray(x) / self.cell_size).astype(np.int64) - self.origin[0]
+        return np.clip(cx, 0, cols-1)
+
+    def cell_y(self, y, rows=None):
+        '''Get the grid row of y coordinates, clamped to the grid'''
+        rows = self.table.shape[0] if rows is None else rows
+        cy = np.floor(np.asarray(y) / self.cell_size).astype(np.int64) - self.origin[1]
+        return np.clip(cy, 0, rows-1)
+
+    def query_rect(self, x1, y1, x2, y2):
+        '''Get the indices of all walls in the grid cells overlapping a rectangle'''
+        cx0, cx1 = self.cell_x(min(x1,x2)), self.cell_x(max(x1,x2))
+        cy0, cy1 = self.cell_y(min(y1,y2)), self.cell_y(max(y1,y2))
+        found = self.table[cy0:cy1+1, cx0:cx1+1].ravel()
+        return np.unique(found[found >= 0])
+
+    def collide(self, step_vector):
+        '''Check if a single step (x1,y1,x2,y2) intersects any wall'''
+        return bool(self.collide_many(np.array([step_vector], dtype=np.float64))[0])
+
+    def collide_many(self, steps):
+        '''Check an array of steps, shape (m,4), against the walls at once
+
+        Returns a boolean array with one entry per step. A step no longer than
+        a cell in either direction touches at most 2x2 grid cells, so it is only
+        tested against the walls bucketed in those cells. Longer steps are
+        tested against every wall.'''
+        steps = np.asarray(steps, dtype=np.float64).reshape(-1, 4)
+        hit = np.zeros(len(steps), dtype=bool)
+        if not len(self.walls) or not len(steps):
+            return hit
+
+        lo_x = np.minimum(steps[:,0], steps[:,2])
+        hi_x = np.maximum(steps[:,0], steps[:,2])
+        lo_y = np.minimum(steps[:,1], steps[:,3])
+        hi_y = np.maximum(steps[:,1], steps[:,3])
+        short = (hi_x - lo_x <= self.cell_size) & (hi_y - lo_y <= self.cell_size)
+
+        if short.any():
+            cx0, cx1 = self.cell_x(lo_x[short]), self.cell_x(hi_x[short])
+            cy0, cy1 = self.cell_y(lo_y[short]), self.cell_y(hi_y[short])
+            candidates = np.concatenate([self.table[cy0,cx0], self.table[cy0,cx1],
+                                         self.table[cy1,cx0], self.table[cy1,cx1]], axis=1)
+            hit[short] = self.intersect(steps[short], candidates)
+        if not short.all():
+            hit[~short] = self.intersect(steps[~short])
+        return hit
+
+    def intersect(self, steps, candidates=None):
+        '''Test each step against its candidate walls, or all walls if candidates is None
+
+        candidates is an (m,k) array of wall indices, padded with -1.
+        using math from: https://en.wikipedia.org/wiki/Line%E2%80%93line_intersection'''
+        if candidates is None:
+            x3, y3, wdx, wdy = self.x3, self.y3, self.dx, self.dy
+            valid = True
+        else:
+            x3, y3 = self.x3[candidates], self.y3[candidates]
+            wdx, wdy = self.dx[candidates], self.dy[candidates]
+            valid = candidates >= 0
+
+        # step terms as columns so they broadcast against the wall rows
+        x1 = steps[:,0,None]
+        y1 = steps[:,1,None]
+        sx = x1 - steps[:,2,None] # x1-x2
+        sy = y1 - steps[:,3,None] # y1-y2
+        ox = x1 - x3 # x1-x3
+        oy = y1 - y3 # y1-y3
+
+        denom = sx*wdy - sy*wdx
+        t_num = ox*wdy - oy*wdx
+        u_num = -(sx*oy - sy*ox)
+
+        # parallel or coincedent walls (denom == 0) never collide
+        hit = valid & (denom != 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = t_num / denom
+            u = u_num / denom
+        # (0<t means there is no collision if the players path starts on a wall)
+        hit &= (0 < t) & (t <= 1) & (0 <= u) & (u <= 1)
+        return hit.any(axis=1)
+
+
+def as_walls(walls):
+    '''Return walls as a Walls object, building one from a plain wall list if needed'''
+    if isinstance(walls, Walls):
+        return walls
+    return Walls(walls)
@@ -1,54 +1,117 @@
-import pygame
+# no pygame here, the server imports this without it. The client's keys are in clientkeys.py
 
-# Pygame
+# Screen
 CAPTION = "Hide and Seek!"
 SCREEN_SIZE = 640,400
 BACKGROUND_COLOR = (0,0,0,0)
 
-# get the client arrow keys
-CLIENT_UP_KEY = pygame.K_UP
-CLIENT_DOWN_KEY = pygame.K_DOWN
-CLIENT_RIGHT_KEY = pygame.K_RIGHT
-CLIENT_LEFT_KEY = pygame.K_LEFT
-CLIENT_ARROW_KEYS = [CLIENT_UP_KEY, CLIENT_DOWN_KEY, CLIENT_RIGHT_KEY, CLIENT_LEFT_KEY]
-
 # create codes so control keys are the same across os
 UP_KEY = 0
 DOWN_KEY = 1
 RIGHT_KEY = 2
 LEFT_KEY = 3
 ARROW_KEYS = [UP_KEY, DOWN_KEY, RIGHT_KEY, LEFT_KEY]
-
-CLIENT_TO_PROTOCOL = {
-    CLIENT_UP_KEY:UP_KEY,
-    CLIENT_DOWN_KEY:DOWN_KEY,
-    CLIENT_RIGHT_KEY:RIGHT_KEY,
-    CLIENT_LEFT_KEY:LEFT_KEY
-}
+# inputs are a bitmask with the bit 1 << key set for each key held down
 
 
 # Server Config
 SERVER_ADDRESS = ('34.224.98.28', 10001)
 # SERVER_ADDRESS = ('172.25.32.1', 10001)
+# 'threaded' or 'asyncio', can be changed with: python server.py --engine asyncio
+SERVER_ENGINE = 'threaded'
+# lobby settings, run the lobby with: python server.py --lobby
+# the lobby on SERVER_ADDRESS sends each login to a room on one of the next ports
+ROOM_COUNT = 64
+ROOM_CAPACITY = 16
+# worker processes the rooms are spread over, None uses one per cpu
+ROOM_WORKERS = None
+# seconds a room has to count a redirected player before the lobby forgets the redirect
+REDIRECT_TIMEOUT = 2
 INACTIVE_TIME = 60
 MAX_PACKET = 2048
+# largest datagram sent, bigger updates are split into fragments of this size
+MTU = 1200
+# number of partly received fragmented updates a client keeps
+FRAGMENT_BUFFER = 8
+# extra distance past the edge of the screen that other players are sent for
+VIEW_MARGIN = 100
+# number of sent updates kept as delta baselines, 3.2 seconds at 100 ms per update
+SNAPSHOT_HISTORY = 32
+# seconds before a kicked player's id is given to someone else, longer than MAX_REWIND and a few updates
+ID_REUSE_DELAY = 5
+# local address of the json stats endpoint, None for off, e.g. ('127.0.0.1', 9101) or: python server.py --stats-port 9101
+STATS_ADDRESS = None
+# file a json line of stats is appended to every STATS_INTERVAL seconds, None for off
+STATS_FILE = None
+STATS_INTERVAL = 10
+# server log level, can be changed with: python server.py --log-level debug
+LOG_LEVEL = 'info'
+
+# simulation ticks per second, player speeds are in pixels per tick
+TICK_RATE = 30
+# updates sent to the clients per second
+BROADCAST_RATE = 10
+# most missed ticks run back to back to catch up, any more are skipped
+MAX_CATCH_UP = 5
+# how Game.update moves the players, 'batched' steps them all at once in numpy arrays (playertable.py), 'objects' one at a time,
+# 'auto' batches from BATCHED_MIN_PLAYERS players up, below that the numpy overhead costs more than it saves
+SIMULATION = 'auto'
+BATCHED_MIN_PLAYERS = 100
+# predicted client ticks kept to replay on top of server updates, 2 seconds
+INPUT_HISTORY = 2 * TICK_RATE
+# seconds in the past other players are drawn, so there are two updates to move them between
+INTERPOLATION_DELAY = 2 / BROADCAST_RATE
+# seconds other players keep moving when updates stop, before they stop
+MAX_EXTRAPOLATION = 0.25
+# updates kept per player for interpolation
+INTERPOLATION_BUFFER = 16
+# longest a catch is rewound for a seeker's latency, in seconds and ticks
+MAX_REWIND = 0.5
+MAX_REWIND_TICKS = int(MAX_REWIND * TICK_RATE)
+# size of the cells players are bucketed into to find the hiders near each seeker
+CATCH_CELL_SIZE = 128
 
 # game rules
+# 'classic' has one seeker, 'seekers' has SEEKER_COUNT of them, in 'infection' caught hiders become seekers
+GAME_MODE = 'classic'
+SEEKER_COUNT = 3
 COOLDOWN_TIME = 10
 HIDE_TIME = 5
 SEEK_TIME = 30
 
 # map size
 MAP_SIZE = 20
-MAP_CENTER = [480,480]
+CELL_SIZE = 50
+# number of built maps each game keeps, keyed by seed. Every game (each lobby room too) has its own cache and map thread
+MAP_CACHE_SIZE = 8
+# the client draws the maze once into square tiles of this many pixels, and keeps at most MAP_TILE_CACHE of them
+MAP_TILE_SIZE = 256
+MAP_TILE_CACHE = 64
+# rendered names, scores and banners the client keeps
+TEXT_CACHE_SIZE = 256
+# how far the name and score above a player reach, to tell if any of it is on screen
+LABEL_HALF_WIDTH = 60
+LABEL_HEIGHT = 52
+# spawn point in the cleared out middle of the maze, (480,480) for a 20x20 map
+MAP_CENTER = [MAP_SIZE*CELL_SIZE//2 - 20, MAP_SIZE*CELL_SIZE//2 - 20]
+
+# player roles, small ints that are cheap to compare and are sent as is
+GHOST_ROLE = 0
+HIDER_ROLE = 1
+SEEKER_ROLE = 2
+ROLE_NAMES = ['ghost', 'hider', 'seeker']
 
 # Role speeds
 SEEKER_SPEED = 9
 HIDER_SPEED = 7
 GHOST_SPEED = 10
+ROLE_SPEEDS = {SEEKER_ROLE: SEEKER_SPEED, HIDER_ROLE: HIDER_SPEED, GHOST_ROLE: GHOST_SPEED}
+MAX_SPEED = max(ROLE_SPEEDS.values())
 
 # Colors
 SEEKER = (255,0,0)
 BGSEEKER = (10,10,10)
 GHOST = (30,30,30)
-BGGHOST = (100,100,100)
\ No newline at end of file
+BGGHOST = (100,100,100)
+WALL_COLOR = (255,255,255)
+WALL_WIDTH = 3
\ No newline at end of file
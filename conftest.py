@@ -0,0 +1,2 @@
+# test_sender.py is a manual udp script, not a test. Importing it waits for a server reply
+collect_ignore = ['test_sender.py']
@@ -1,4 +1,3 @@
-import pygame
 import os, sys
 import numpy as np
 import socket 
@@ -7,18 +6,17 @@ import threading
 import time
 import random
 
+from collision import Walls
+from mapcache import MapCache
 from mapmaker import Maze
-from player import Player
+from playertable import PlayerTable
+from spatial import SpatialHash
 
 from config import *
 
 # TODO figure out self.start_time, start_time
 # TODO Seeker countdown
 
-# stress test the max number of players
-# handle when there are more players than the byte-size can handle
-
-# TODO combine map segments to reduce number of walls
 # TODO Allow player to move diagonally along wall
 # Create a config.txt file so that changing parameters like 
 #      serveraddress, etc. does not need to be commits to the game file.
@@ -35,16 +33,22 @@ class Game:
         
         # game fps and loop condiiton
         self.done = False
-        self.clock = pygame.time.Clock()
-        self.fps = 30
+        self.fps = TICK_RATE
         self.state = "waiting"
 
         # create an empty list for the players
         self.players = []
+        # the arrays the batched simulation steps the players in
+        self.simulation = SIMULATION
+        self.table = PlayerTable()
+        # the players bucketed by position, to only test the ones near a seeker for catches
+        self.spatial = SpatialHash()
 
         # setup map -- a list of coordinate pairs
         self.map_seed = -1
-        self.map = []
+        self.map = Walls([])
+        # maps are built in the background and kept by seed
+        self.map_cache = MapCache(self.generate_map)
         
         # set a start timer for timestamps
         self.start_time = time.time()
@@ -52,17 +56,61 @@ class Game:
 
     def update(self):
         '''update all bullets, and the player motion'''
+        if self.simulation == 'batched' or (self.simulation == 'auto' and len(self.players) >= BATCHED_MIN_PLAYERS):
+            self.update_batched()
+        else:
+            self.update_objects()
+
+    def index_players(self):
+        '''Bring the spatial hash up to date with where the players are, call this after they move and before nearby()'''
+        self.spatial.sync([(player, player.location[0], player.location[1]) for player in self.players])
+
+    def nearby(self, rect, reach=0):
+        '''Get the players the spatial hash has within reach of a rect, and maybe a few more'''
+        # a player's rect reaches out from its location by up to its width
+        reach += rect.width
+        return self.spatial.query(rect.left - reach, rect.top - reach, rect.right + reach, rect.bottom + reach)
+
+    def update_batched(self):
+        '''Move every player at once in the numpy arrays of the player table'''
+        players = list(self.players)
+        self.table.load(players)
+        # the seeker has to wait while the hiders hide
+        moved = self.table.step(self.map, SEEKER_ROLE if self.state == 'hiding' else None)
+        self.table.store(players, moved)
+
+    def update_objects(self):
+        '''Move the players one at a time
+
+        every player's step is checked against the walls in a single batched call'''
+        moves = []
         for player in self.players:
-            if not (player.role == 'seeker' and self.state == 'hiding'):
-                player.update_location(self.map)
+            if player.role == SEEKER_ROLE and self.state == 'hiding':
+                continue
+            dx, dy = player.get_step()
+            newspot = [player.location[0] + dx, player.location[1] + dy]
+            if player.role == GHOST_ROLE:
+                player.location = newspot
+            elif dx != 0 or dy != 0:
+                moves.append((player, list(player.location)+newspot))
+
+        if moves:
+            blocked = self.map.collide_many([step for _, step in moves])
+            for (player, step), hit in zip(moves, blocked):
+                if not hit:
+                    player.location = step[2:]
         # print(self.player.location)
     
     def get_caught(self, seeker):
-        '''get a list of all hiding players that collide with the seeker'''
+        '''get a list of all hiding players that collide with the seeker
+
+        tests every player, so it is right wherever the players moved since
+        the last index_players(). The server's get_catches syncs the spatial
+        hash once a tick and only tests the players near each seeker'''
         seeker_rect = seeker.get_rect()
         caught = []
         for player in self.players:
-            if player != seeker and player.role == 'hider' and player.get_rect().colliderect(seeker_rect):
+            if player is not seeker and player.role == HIDER_ROLE and player.get_rect().colliderect(seeker_rect):
                 caught.append(player)
         return caught
 
@@ -72,6 +120,7 @@ class Game:
         pass
 
     def generate_map(self,seed):
-        maze = Maze(20,20,10,10)
+        '''Build the walls of the MAP_SIZE x MAP_SIZE maze for a seed'''
+        maze = Maze(MAP_SIZE,MAP_SIZE,MAP_SIZE//2,MAP_SIZE//2)
         maze.make_maze(seed)
-        return maze.get_wall_list()
+        return Walls(maze.get_wall_list())
@@ -1,15 +1,52 @@
+import json
+import math
 import socket
 import threading 
 import random 
 import time
-import pickle
+from collections import Counter
 
+import protocol
 from game import Game 
-from player import Player
+from player import PlayerState
+from interest import AreaGrid
+from registry import PlayerRegistry
+from timestep import FixedTimestep
+from rewind import PositionHistory
+from metrics import ServerMetrics, get_logger, serve_stats
+from snapshots import SnapshotHistory, take_snapshot, delta, SCOREBOARD_FIELDS, POSITION_FIELDS
 
 from config import *
 
 
+log = get_logger(__name__)
+
+
+class ConnectedPlayer(PlayerState):
+    '''A player on the server, with the connection it plays from'''
+    __slots__ = ('address', 'last_active', 'received_inputs', 'input_seq', 'input_ticks',
+                 'acked_timestamp', 'rtt', 'views', 'login_time', 'bytes_sent')
+
+    def __init__(self, location, username, address):
+        PlayerState.__init__(self, location, username)
+        self.address = address
+        self.last_active = time.time()
+        # the newest (seq, inputs) received, applied at the start of the next tick
+        self.received_inputs = (0, 0)
+        # the seq of the inputs in use and the number of ticks simulated with them
+        self.input_seq = 0
+        self.input_ticks = 0
+        # no update acknowledged yet, so the first one is a full snapshot
+        self.acked_timestamp = None
+        # smoothed round trip time in seconds, measured from the update acks
+        self.rtt = None
+        # the positions sent to this player, the baselines for its delta updates
+        self.views = SnapshotHistory()
+        # bytes of updates sent to this player since it logged in
+        self.login_time = time.time()
+        self.bytes_sent = 0
+
+
 class HeadlessGameServer(Game):
     '''Class for creating the hide-and-seek game server'''
     def __init__(self):
@@ -17,35 +54,77 @@ class HeadlessGameServer(Game):
         # initialize game attrs
         Game.__init__(self)
 
-        # create player list
-        self.players = []
-        self.seeker = None
+        # create player registry, players are looked up by address and get
+        # small integer ids sent in place of usernames in updates
+        self.players = PlayerRegistry()
+        # 'classic', 'seekers' or 'infection', see GAME_MODE
+        self.mode = GAME_MODE
 
         # create the socket used for the server
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 
         # create an initial map for the game
         self.map_seed = random.randint(1,100)
-        print('generating initial map with seed: %d' % self.map_seed)
-        self.map = self.generate_map(self.map_seed)
+        log.info('generating initial map with seed: %d', self.map_seed)
+        self.map = self.map_cache.get(self.map_seed)
+        # pick the next round's map now so it is built before the round ends
+        self.next_map_seed = self.prefetch_next_map()
 
         # use this to notify all players when their 
         self.countdown_timer = None
+
+        # recently sent scoreboards, the baselines for delta updates
+        self.history = SnapshotHistory()
+        # ids for the fragments of updates too big for one datagram
+        self.next_message_id = 0
+
+        # the simulation runs on numbered ticks of 1/TICK_RATE seconds
+        self.timestep = FixedTimestep()
+        # held while a tick runs, so updates never see a half simulated tick
+        self.tick_lock = threading.Lock()
+        # where everyone was over the last MAX_REWIND seconds, catches are checked against what the seeker saw
+        self.positions = PositionHistory()
+        # when each update was sent, to measure round trips from the acks
+        self.send_times = SnapshotHistory()
+        # reset_tick is the tick when a round ends or the server starts
+        self.reset_tick = 0
+        # the newest tick sent to the clients, and the counters as of the last budget warning
+        self.broadcast_tick = -1
+        self.reported_overruns = 0
+        self.reported_tick = 0
+
+        # tick timings, packet and byte counters, see stats()
+        self.metrics = ServerMetrics()
+        # where stats are served and dumped, None for off
+        self.stats_address = STATS_ADDRESS
+        self.stats_file = STATS_FILE
+        self.stats_time = time.time()
     
     # create UDP Server
+    def bind_address(self):
+        '''Get the local address the server listens on'''
+        return (socket.gethostbyname(socket.getfqdn()),SERVER_ADDRESS[1])
+
     def setup_server(self):
         '''Bind the server to the serverport and start the input and notification threads'''
-        self.socket.bind((socket.gethostbyname(socket.getfqdn()),SERVER_ADDRESS[1]))
-        print("starting server at %s:%d" % self.socket.getsockname())
+        self.socket.bind(self.bind_address())
+        log.info("starting server at %s:%d", *self.socket.getsockname())
+        self.start_stats()
         
-        print("starting serve thread")
+        log.info("starting serve thread")
         t = threading.Thread(target=self.serve_forever)
         t.setDaemon(True) # don't hang on exit
         t.start()
-        print("starting reply server")
+        log.info("starting reply server")
         t2 = threading.Thread(target=self.notify_clients)
         t2.setDaemon(True) # don't hang on exit
         t2.start()
+
+    def start_stats(self):
+        '''Start the stats endpoint, if there is a stats address'''
+        if self.stats_address:
+            serve_stats(self.stats_address, self.stats)
+            log.info("serving stats at http://%s:%d/", *self.stats_address)
     
     def serve_forever(self):
         '''Receive and handle packets from the UDP Port'''
@@ -57,52 +136,64 @@ class HeadlessGameServer(Game):
             except ConnectionResetError:
                 # TODO do something here to recover when a client has disconnected?
                 pass
+            except protocol.ProtocolError:
+                # drop anything that is not a valid datagram
+                pass
     
     def parse_data(self, data, address):
         '''Parse and handle a packet
         
         Set the player inputs, handle a login, and reply if necessary'''
-        # unpickle the data
-        data = pickle.loads(data)
+        self.metrics.packets_in += 1
+        self.metrics.bytes_in += len(data)
+        # decode the data
+        data = protocol.decode(data)
+        self.metrics.received[data['type']] = self.metrics.received.get(data['type'], 0) + 1
         
         # handle client login
         if data["type"] == "login":
-            # username already taken
-            if [x for x in self.players if x.username == data['username']]:
-                self.socket.sendto(pickle.dumps({'type':'login_ack','status':'bad'}), address)
+            newPlayer = ConnectedPlayer(MAP_CENTER,data['username'],address)
+
+            # register user, this fails if the username is already taken
+            if not self.players.add(newPlayer):
+                self.socket.sendto(protocol.encode({'type':'login_ack','status':'bad'}), address)
             else:
-                # ack
-                self.socket.sendto(pickle.dumps({'type':'login_ack', 'status':'ok'}), address) # TODO: Send the map with a larger packet size?
+                # ack with the id the player will have in updates
+                self.socket.sendto(protocol.encode({'type':'login_ack', 'status':'ok', 'id':newPlayer.id}), address)
                 # print('replied to %s login_ack' % data['username'])
-                # register user
-                newPlayer = Player(MAP_CENTER,data['username'])
-                newPlayer.address = address
-                newPlayer.last_active = time.time()
-                newPlayer.last_timestamp = data['timestamp']
-                self.players.append(newPlayer)
-                print("login: %s" % newPlayer.username)
+                log.info("login: %s", newPlayer.username)
                 
         # handle client inputs
         if data["type"] == "inputs":
             # get the Player Object for the player
-            client_player = [x for x in self.players if x.address == address]
+            client_player = self.players.get_by_address(address)
 
             # reply with kick message if player is not registered
-            if not client_player:
-                self.socket.sendto(pickle.dumps({'type':'kick'}), address)
-
-            # if this is the most recent client-timestamp
-            elif client_player and data['timestamp'] >= client_player[0].last_timestamp:
-                # reply with ack
-                self.socket.sendto(pickle.dumps({'type':'inputs_ack','inputs':data['inputs']}), address)
-                print('replied to %s inputs_ack' % client_player[0].username)
-                # apply inputs to player
-                # print('setting inputs for:',client_player[0].username,'inputs are:',data['inputs'])
-                client_player[0].inputs = data['inputs']
-                client_player[0].last_timestamp = data['timestamp']
+            if client_player is None:
+                self.socket.sendto(protocol.encode({'type':'kick'}), address)
+
+            # if these are the most recent client inputs
+            elif data['seq'] > client_player.received_inputs[0]:
+                # the inputs take effect on the next tick, updates acknowledge them with their seq
+                # print('setting inputs for:',client_player.username,'inputs are:',data['inputs'])
+                client_player.received_inputs = (data['seq'], data['inputs'])
 
                 # prevent timeout
-                client_player[0].last_active = time.time()
+                client_player.last_active = time.time()
+
+        # handle client update acknowledgements, the newest one is the baseline for the next delta
+        if data["type"] == "update_ack":
+            client_player = self.players.get_by_address(address)
+            if client_player is not None and (client_player.acked_timestamp is None or data['ack'] > client_player.acked_timestamp):
+                client_player.acked_timestamp = data['ack']
+                # the client acks as soon as an update arrives, so the time since it was sent is a round trip
+                sent = self.send_times.get(data['ack'])
+                if sent is not None:
+                    sample = time.time() - sent
+                    if client_player.rtt is None:
+                        client_player.rtt = sample
+                    else:
+                        client_player.rtt += (sample - client_player.rtt) / 8
                 
     def kick_inactive(self):
         # kick any inactive players
@@ -111,111 +202,282 @@ class HeadlessGameServer(Game):
             if time.time() - player.last_active > INACTIVE_TIME:
                 inactive.append(player)
         for player in inactive:
-            print('kicking: %s' % player.username)
-            self.socket.sendto(pickle.dumps({'type':'kick'}), player.address)
+            log.info('kicking: %s', player.username)
+            self.socket.sendto(protocol.encode({'type':'kick'}), player.address)
             self.players.remove(player)
     
     def notify_clients(self):
-        '''Send gamestate information to all clients at intervals'''
-        start = time.time()
+        '''Send gamestate information to all clients at BROADCAST_RATE'''
+        next_update = time.time()
         while True:
-            # send along a timestamp! the client will only apply the most recent timestamp update
-            timestamp = int((time.time()-start)*10) 
-            # create update object to send 
-            data = pickle.dumps({'type':        'update',
-                                 'players':     self.players,
-                                 'game_state':  self.state,
-                                 'map_seed':    self.map_seed,
-                                 'timestamp':   timestamp})
-            # send update to all clients
-            for p in self.players:
-                addr = p.address
-                # print(addr,data)
-                self.socket.sendto(data, addr)
-                # print("notifying: %s:%d" % addr)
-            
-            time.sleep(0.100) # update clients at 100 ms interval
-            
+            self.broadcast()
+            # schedule against the ideal times so a slow broadcast doesn't push the rest back
+            now = time.time()
+            next_update = max(next_update + 1/BROADCAST_RATE, now)
+            time.sleep(next_update - now)
+
+    def broadcast(self):
+        '''Send the clients an update for the newest tick, if it wasn't sent yet'''
+        for _ in self.iter_broadcast():
+            pass
+
+    def iter_broadcast(self):
+        '''Send the clients an update for the newest tick, yielding after each client'''
+        # send along the tick as timestamp! the client will only apply the most recent timestamp update
+        tick = self.timestep.tick - 1
+        if tick > self.broadcast_tick:
+            self.broadcast_tick = tick
+            yield from self.iter_updates(tick)
+
+    def send_updates(self, timestamp):
+        '''Send every client an update for the current game state'''
+        for _ in self.iter_updates(timestamp):
+            pass
+
+    def iter_updates(self, timestamp):
+        '''Send every client an update for the current game state, yielding after each client
+
+        Each client gets the scoreboard changes since the last update it
+        acknowledged, encoded once per distinct baseline, plus the position
+        changes of only the players in its area of interest. Yielding lets the
+        asyncio server handle packets in between clients.'''
+        with self.tick_lock:
+            players = list(self.players)
+            # snapshot the game and keep the scoreboard as a baseline for later deltas
+            scoreboard = take_snapshot(players, SCOREBOARD_FIELDS)
+            positions = take_snapshot(players, POSITION_FIELDS)
+            # the inputs each client's position was simulated with
+            acks = {p.id: (p.input_seq, p.input_ticks) for p in players}
+            game_state, map_seed, next_map_seed = self.state, self.map_seed, self.next_map_seed
+        self.history.add(timestamp, scoreboard)
+        self.send_times.add(timestamp, time.time())
+        area = AreaGrid(players)
+
+        shared = {}
+        for p in players:
+            start = time.perf_counter()
+            # the positions this client can see, kept as its own baseline for later deltas
+            view = {player_id: positions[player_id] for player_id in area.visible(p)}
+            baseline = p.acked_timestamp
+            if self.history.get(baseline) is None or p.views.get(baseline) is None:
+                baseline = -1
+
+            if baseline not in shared:
+                changed, removed = delta(self.history.get(baseline) or {}, scoreboard)
+                shared[baseline] = (protocol.encode_players(changed), removed)
+            changed, removed = shared[baseline]
+            local, hidden = delta(p.views.get(baseline) or {}, view)
+            p.views.add(timestamp, view)
+
+            data = protocol.encode_update({'baseline':     baseline,
+                                           'local':        local,
+                                           'removed':      removed,
+                                           'hidden':       hidden,
+                                           'game_state':   game_state,
+                                           'map_seed':     map_seed,
+                                           'next_map_seed': next_map_seed,
+                                           'timestamp':    timestamp,
+                                           'ack_seq':      acks[p.id][0],
+                                           'ack_ticks':    acks[p.id][1]}, changed)
+            self.metrics.encode_seconds.observe(time.perf_counter() - start)
+            self.metrics.updates_sent += 1
+            # split updates too big for a single datagram
+            self.next_message_id += 1
+            for datagram in protocol.fragment(data, self.next_message_id):
+                self.socket.sendto(datagram, p.address)
+                self.metrics.packets_out += 1
+                self.metrics.bytes_out += len(datagram)
+                p.bytes_sent += len(datagram)
+            yield p
             
     def main_loop(self):
         '''Main control loop
         
         Run the game simulation and handle game state changes'''
 
-        # reset_time is the time when a round ends or the server starts
-        reset_time = time.time()
-
         # waiting for players to join to start the game
         self.state="waiting"
+        self.reset_tick = self.timestep.tick
 
         while not self.done:
             # the client inputs are handled in a separate thread, here we just simulate the game
-            self.update()
-
-            # get all players caught by seeker, set them to ghosts, increment seeker score
-            if self.state == "seeking":
-                caught = self.get_caught(self.seeker)
-                for p in caught:
-                    print("%s was caught" % p.username)
-                    p.role = "ghost"
+            time.sleep(self.timestep.run(self.tick))
+            self.check_budget()
+            self.report_stats()
+
+    def check_budget(self):
+        '''Warn when ticks went over their cpu budget, at most once a second'''
+        timestep = self.timestep
+        overruns = timestep.overruns + timestep.skipped
+        if overruns > self.reported_overruns and timestep.tick - self.reported_tick >= timestep.rate:
+            log.warning('tick %d: %d ticks over budget, %d skipped, load %.0f%%, slowest tick %.1f ms',
+                        timestep.tick, timestep.overruns, timestep.skipped, timestep.load()*100, timestep.max_cost*1000)
+            self.reported_overruns = overruns
+            self.reported_tick = timestep.tick
+
+    def report_stats(self):
+        '''Update the metrics rates and append the stats to the stats file every STATS_INTERVAL seconds'''
+        self.metrics.roll()
+        if self.stats_file and time.time() - self.stats_time >= STATS_INTERVAL:
+            self.stats_time = time.time()
+            with open(self.stats_file, 'a') as f:
+                f.write(json.dumps(self.stats()) + '\n')
+
+    def stats(self):
+        '''Get the server metrics, tick counters and players as a dict'''
+        now = time.time()
+        players = list(self.players)
+        return {'time':      now,
+                'state':     self.state,
+                'players':   len(players),
+                'roles':     {ROLE_NAMES[role]: count for role, count in Counter(p.role for p in players).items()},
+                'timestep':  self.timestep.stats(),
+                'metrics':   self.metrics.stats(),
+                # average update bandwidth of each client since it logged in
+                'clients':   {p.username: {'id': p.id,
+                                           'rtt_ms': None if p.rtt is None else p.rtt * 1000,
+                                           'bytes_per_second': p.bytes_sent / max(now - p.login_time, 1e-9)}
+                              for p in players}}
+
+    def tick(self, tick):
+        '''Advance the game by one tick
+
+        Apply the newest inputs, run the simulation, handle catches and game state changes'''
+        start = time.perf_counter()
+        with self.tick_lock:
+            self.run_tick(tick)
+        self.metrics.tick_seconds.observe(time.perf_counter() - start)
+
+    def run_tick(self, tick):
+        '''The body of tick, run with the tick lock held'''
+        # new inputs only take effect at the start of a tick, so the ticks simulated with them can be counted
+        for player in self.players:
+            seq, inputs = player.received_inputs
+            if seq != player.input_seq:
+                player.input_seq = seq
+                player.inputs = inputs
+                player.input_ticks = 0
+
+        self.update()
+        for player in self.players:
+            player.input_ticks += 1
+        self.positions.record(tick, self.players)
+
+        # get all players caught by the seekers, set them to ghosts (or seekers in infection), increment seeker score
+        if self.state == "seeking":
+            for p, seeker in self.get_catches(tick).items():
+                log.info("%s was caught by %s", p.username, seeker.username)
+                if self.mode == 'infection':
+                    p.role = SEEKER_ROLE
+                    p.speed = SEEKER_SPEED
+                else:
+                    p.role = GHOST_ROLE
                     p.speed = GHOST_SPEED
-                    self.seeker.score += 2
+                seeker.score += 2
+
+        # handle game state changes, the timers count ticks so they keep game time under load
+        if len(self.players) < 2:
+            self.state = "waiting"
+            self.reset_tick = tick
+            self.kick_inactive()
+        elapsed = (tick - self.reset_tick) / self.timestep.rate
+        if self.state == "waiting" and elapsed > COOLDOWN_TIME:
+            self.round_start()
+        elif self.state == "hiding" and elapsed > COOLDOWN_TIME + HIDE_TIME:
+            self.seeker_start()
+        elif self.state == "seeking" and elapsed > COOLDOWN_TIME + HIDE_TIME + SEEK_TIME:
+            self.round_end()
+            self.reset_tick = tick
+
+    def rewind_ticks(self, player):
+        '''Get how many ticks behind the server a player sees the others, at most MAX_REWIND seconds
 
-            # handle game state changes
-            if len(self.players) < 2:
-                self.state = "waiting"
-                reset_time = time.time()
-                self.kick_inactive()
-            if self.state == "waiting" and time.time() - reset_time > COOLDOWN_TIME:
-                self.round_start()
-            elif self.state == "hiding" and time.time() - reset_time > COOLDOWN_TIME + HIDE_TIME:
-                self.seeker_start()
-            elif self.state == "seeking" and time.time() - reset_time > COOLDOWN_TIME + HIDE_TIME + SEEK_TIME:
-                self.round_end()
-                reset_time = time.time()
+        the others are drawn INTERPOLATION_DELAY in the past, and the update
+        showing them and the inputs reacting to them take a round trip'''
+        rtt = player.rtt or 0
+        return min(int(round((rtt + INTERPOLATION_DELAY) * self.timestep.rate)), MAX_REWIND_TICKS)
 
+    def get_catches(self, tick):
+        '''Get the hiders caught this tick, a dict of hider -> the seeker that caught it
 
-            self.clock.tick(self.fps)
+        a hider touched by several seekers goes to the first of them'''
+        self.index_players()
+        caught = {}
+        for seeker in [player for player in self.players if player.role == SEEKER_ROLE]:
+            for player in self.get_caught_rewound(seeker, tick):
+                caught.setdefault(player, seeker)
+        return caught
+
+    def get_caught_rewound(self, seeker, tick):
+        '''get a list of all hiding players that collide with the seeker
+
+        the hiders are checked where the seeker saw them when it moved, so
+        seekers with a slow connection can still catch what is on their screen.
+        Only the hiders the spatial hash has near the seeker are checked, as
+        far out as a hider can have run since then, so the hash has to be
+        synced first like get_catches does.'''
+        seeker_rect = seeker.get_rect()
+        rewind = self.rewind_ticks(seeker)
+        hiders = [player for player in self.nearby(seeker_rect, MAX_SPEED * rewind)
+                  if player is not seeker and player.role == HIDER_ROLE]
+        if not hiders:
+            return []
+        # as python floats, rects are much quicker to make from them than from numpy scalars
+        past = self.positions.get(tick - rewind, [player.id for player in hiders]).tolist()
+        caught = []
+        for player, location in zip(hiders, past):
+            # players that weren't there back then are checked where they are now
+            if math.isnan(location[0]):
+                location = player.location
+            if player.get_rect(location).colliderect(seeker_rect):
+                caught.append(player)
+        return caught
 
     def round_start(self):
         '''Start the round'''
         self.state="hiding"
-        print("ROUND START...")
+        log.info("ROUND START...")
 
         # reset all players
         for player in self.players:
-            player.role = "hider"
+            player.role = HIDER_ROLE
             player.speed = HIDER_SPEED
             player.location = MAP_CENTER.copy()
             player.location[0] += random.uniform(-25,25)
             player.location[1] += random.uniform(-25,25)
 
-        # randomly select a seeker
-        self.seeker = random.choice(self.players)
-        self.seeker.role = "seeker"
-        self.seeker.speed = SEEKER_SPEED
+        # randomly select the seekers, leaving at least one hider
+        count = SEEKER_COUNT if self.mode == 'seekers' else 1
+        for seeker in random.sample(list(self.players), max(1, min(count, len(self.players) - 1))):
+            seeker.role = SEEKER_ROLE
+            seeker.speed = SEEKER_SPEED
 
     def seeker_start(self):
         '''Start the seeker phase'''
         self.state = "seeking"
-        print("SEEKER START...")
+        log.info("SEEKER START...")
 
 
     def round_end(self):
         '''End the round'''
         self.state = "waiting"
-        print("ROUND END...")
+        log.info("ROUND END...")
         for player in self.players:
-            if player.role == "hider":
+            if player.role == HIDER_ROLE:
                 player.score += 1
-            player.role = "ghost"
+            player.role = GHOST_ROLE
             player.speed = GHOST_SPEED
 
-        self.seeker = None
-
         self.kick_inactive()
 
-        # start generating the next map
-        self.map_seed = random.randint(1,100)
-        print('generating new map with seed: %d' % self.map_seed)
-        self.map = self.generate_map(self.map_seed)
\ No newline at end of file
+        # swap in the map that was built in the background during the round
+        self.map_seed = self.next_map_seed
+        log.info('switching to map with seed: %d', self.map_seed)
+        self.map = self.map_cache.get(self.map_seed)
+        self.next_map_seed = self.prefetch_next_map()
+
+    def prefetch_next_map(self):
+        '''Pick the seed for the next round and start building its map in the background'''
+        seed = random.randint(1,100)
+        self.map_cache.prefetch(seed)
+        return seed
\ No newline at end of file
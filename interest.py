@@ -0,0 +1,31 @@
+from config import *
+
+
+class AreaGrid:
+    '''Players bucketed by position for area of interest queries
+
+    A client's area of interest is the rectangle of the screen around its
+    player, padded by VIEW_MARGIN so players don't pop in at the edges. The
+    grid cells are the size of that rectangle, so every query only looks at
+    the players in at most 2x2 cells.'''
+    def __init__(self, players, half_width=SCREEN_SIZE[0]/2 + VIEW_MARGIN, half_height=SCREEN_SIZE[1]/2 + VIEW_MARGIN):
+        '''Bucket the players into cells'''
+        self.half_width = half_width
+        self.half_height = half_height
+        self.cell_width = 2*half_width
+        self.cell_height = 2*half_height
+        self.cells = {}
+        for player in players:
+            cell = (int(player.location[0] // self.cell_width), int(player.location[1] // self.cell_height))
+            self.cells.setdefault(cell, []).append(player)
+
+    def visible(self, player):
+        '''Get the ids of all players in the area of interest around a player, including itself'''
+        x, y = player.location[0], player.location[1]
+        ids = []
+        for cx in range(int((x - self.half_width) // self.cell_width), int((x + self.half_width) // self.cell_width) + 1):
+            for cy in range(int((y - self.half_height) // self.cell_height), int((y + self.half_height) // self.cell_height) + 1):
+                for other in self.cells.get((cx, cy), ()):
+                    if abs(other.location[0] - x) <= self.half_width and abs(other.location[1] - y) <= self.half_height:
+                        ids.append(other.id)
+        return ids
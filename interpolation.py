@@ -0,0 +1,85 @@
+import time
+from collections import deque
+
+from config import *
+
+
+class InterpolationBuffer:
+    '''Recent server positions of the other players, for drawing them smoothly
+
+    Updates only arrive every 1/BROADCAST_RATE seconds, so instead of jumping
+    to each new position the other players are drawn INTERPOLATION_DELAY
+    seconds in the past, moving in a straight line between the two updates
+    around that time. If updates stop coming the players keep moving along
+    their last velocity for at most MAX_EXTRAPOLATION seconds, then stop.
+
+    Times are server ticks. The offset between the server's tick and the
+    local clock is learned from the updates themselves.'''
+    def __init__(self, rate=TICK_RATE, delay=INTERPOLATION_DELAY, max_extrapolation=MAX_EXTRAPOLATION,
+                 size=INTERPOLATION_BUFFER, clock=time.perf_counter):
+        self.rate = rate
+        self.delay = delay * rate
+        self.max_extrapolation = max_extrapolation * rate
+        self.size = size
+        self.clock = clock
+        # player id -> deque of (tick, x, y)
+        self.samples = {}
+        # server tick minus local time in ticks, None until the first update
+        self.offset = None
+
+    def add(self, tick, positions):
+        '''Add the positions of an update, a dict of player id -> location
+
+        players missing from positions left our view, so their samples are dropped'''
+        # the updates that arrived fastest give the offset, late ones are ignored
+        # and it creeps down slowly in case the clocks drift apart
+        sample = tick - self.clock() * self.rate
+        if self.offset is None or sample > self.offset:
+            self.offset = sample
+        else:
+            self.offset += (sample - self.offset) * 0.01
+
+        for player_id in list(self.samples):
+            if player_id not in positions:
+                del self.samples[player_id]
+        for player_id, location in positions.items():
+            samples = self.samples.get(player_id)
+            if samples is None:
+                samples = self.samples[player_id] = deque(maxlen=self.size)
+            elif samples[-1][0] >= tick:
+                continue
+            samples.append((tick, location[0], location[1]))
+
+    def render_tick(self):
+        '''Get the server tick to draw the other players at'''
+        if self.offset is None:
+            return 0
+        return self.clock() * self.rate + self.offset - self.delay
+
+    def position(self, player_id, tick):
+        '''Get where a player was at a server tick, or None if there are no samples for it'''
+        samples = self.samples.get(player_id)
+        if not samples:
+            return None
+        if tick <= samples[0][0]:
+            return [samples[0][1], samples[0][2]]
+
+        # the newest sample before tick and the one after it
+        for i in range(len(samples) - 1, 0, -1):
+            if samples[i-1][0] <= tick:
+                before, after = samples[i-1], samples[i]
+                break
+        else:
+            before = after = samples[-1]
+
+        if tick >= after[0]:
+            # no update that new yet, keep going the way the player was going
+            if before is after:
+                return [after[1], after[2]]
+            tick = min(tick, after[0] + self.max_extrapolation)
+        fraction = (tick - before[0]) / (after[0] - before[0])
+        # a jump further than any player can move is a teleport, like the start of a round
+        if abs(after[1] - before[1]) + abs(after[2] - before[2]) > MAX_SPEED * 2 * (after[0] - before[0]):
+            return [after[1], after[2]] if fraction >= 0.5 else [before[1], before[2]]
+        return [before[1] + (after[1] - before[1]) * fraction,
+                before[2] + (after[2] - before[2]) * fraction]
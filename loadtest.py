@@ -0,0 +1,266 @@
+'''Bot swarm load generator for the game server
+
+Runs thousands of simulated clients in one process on an asyncio event
+loop. Each bot has its own UDP port and speaks the real protocol: it logs
+in (following a lobby redirect), changes its inputs on a script, resends
+inputs the server hasn't acknowledged, and acks every update like the
+client does. No pygame display is opened.
+
+    python loadtest.py --local --bots 500 --duration 20
+    python loadtest.py --address 127.0.0.1:10001 --bots 2000 --json
+
+--local starts a server on localhost in a child process to test against.
+'''
+import argparse
+import asyncio
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import socket
+import time
+
+try:
+    import resource
+except ImportError:
+    # windows has no resource module
+    resource = None
+
+import numpy as np
+
+import protocol
+
+from config import *
+
+
+class Bot(asyncio.DatagramProtocol):
+    '''One simulated client'''
+    def __init__(self, swarm, index):
+        self.swarm = swarm
+        self.username = 'bot%d' % index
+        self.random = random.Random(index)
+        self.transport = None
+        self.server_address = swarm.address
+        self.reassembler = protocol.Reassembler()
+        self.logged_in = False
+        self.failed = False
+        self.input_seq = 0
+        # bitmask of the keys held
+        self.inputs = 0
+        # send time of each inputs seq not acknowledged yet
+        self.input_times = {}
+        self.reset()
+
+    def reset(self):
+        '''Clear the counters, at the start of the measured part of the run'''
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.updates = 0
+        # (arrival time, server tick) of the first and latest update
+        self.first_update = None
+        self.last_update = None
+        # seconds between consecutive updates, and from sending inputs to an update that applied them
+        self.gaps = []
+        self.latencies = []
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def send(self, message, address=None):
+        '''Encode and send a message to the server'''
+        message['timestamp'] = int((time.time() - self.swarm.start_time) * 10)
+        data = protocol.encode(message)
+        self.bytes_out += len(data)
+        self.transport.sendto(data, address or self.server_address)
+
+    def datagram_received(self, data, address):
+        self.bytes_in += len(data)
+        try:
+            message = protocol.decode(data)
+            if message['type'] == 'fragment':
+                data = self.reassembler.add(message)
+                if data is None:
+                    return
+                message = protocol.decode(data)
+        except protocol.ProtocolError:
+            return
+        now = time.perf_counter()
+
+        if message['type'] == 'redirect':
+            self.server_address = (address[0], message['port'])
+            self.send({'type': 'login', 'username': self.username})
+        elif message['type'] == 'login_ack':
+            self.logged_in = message['status'] == 'ok'
+            self.failed = not self.logged_in
+        elif message['type'] == 'kick':
+            self.logged_in = False
+        elif message['type'] == 'update':
+            self.send({'type': 'update_ack', 'ack': message['timestamp']})
+            if self.last_update is not None:
+                if message['timestamp'] <= self.last_update[1]:
+                    return
+                self.gaps.append(now - self.last_update[0])
+            self.updates += 1
+            self.last_update = (now, message['timestamp'])
+            if self.first_update is None:
+                self.first_update = self.last_update
+            for seq in [seq for seq in self.input_times if seq <= message['ack_seq']]:
+                self.latencies.append(now - self.input_times.pop(seq))
+            # resend inputs the server hasn't got after a round trip
+            if message['ack_seq'] < self.input_seq and now - self.input_times.get(self.input_seq, now) > 0.5:
+                self.send({'type': 'inputs', 'inputs': self.inputs, 'seq': self.input_seq})
+
+    def error_received(self, exc):
+        pass
+
+    async def run(self):
+        '''Log in, then keep changing direction like a player would'''
+        while not self.logged_in and not self.failed:
+            self.send({'type': 'login', 'username': self.username}, self.swarm.address)
+            await asyncio.sleep(1)
+        while self.logged_in:
+            await asyncio.sleep(self.random.uniform(0.3, 2))
+            self.inputs = sum(1 << key for key in self.random.sample(ARROW_KEYS, self.random.choice([0, 1, 1, 1, 2])))
+            self.input_seq += 1
+            self.input_times[self.input_seq] = time.perf_counter()
+            self.send({'type': 'inputs', 'inputs': self.inputs, 'seq': self.input_seq})
+
+
+class Swarm:
+    '''A crowd of bots logging in to one server address'''
+    def __init__(self, address, bots):
+        self.address = address
+        self.bots = [Bot(self, i) for i in range(bots)]
+        self.start_time = time.time()
+
+    async def run(self, duration, ramp):
+        '''Log the bots in at ramp logins per second, then measure for duration seconds'''
+        loop = asyncio.get_running_loop()
+        tasks = []
+        for bot in self.bots:
+            await loop.create_datagram_endpoint(lambda: bot, local_addr=('0.0.0.0', 0))
+            tasks.append(asyncio.ensure_future(bot.run()))
+            await asyncio.sleep(1 / ramp)
+        # give the last logins time to get their first updates
+        await asyncio.sleep(2)
+
+        for bot in self.bots:
+            bot.reset()
+        start = time.perf_counter()
+        await asyncio.sleep(duration)
+        report = self.report(time.perf_counter() - start)
+
+        for bot in self.bots:
+            bot.logged_in = False
+            bot.transport.close()
+        for task in tasks:
+            task.cancel()
+        return report
+
+    def report(self, elapsed):
+        '''Summarize the run as a dict'''
+        active = [bot for bot in self.bots if bot.updates > 1]
+        gaps = np.array([gap for bot in active for gap in bot.gaps] or [np.nan])
+        latencies = np.array([latency for bot in self.bots for latency in bot.latencies] or [np.nan])
+        # the server tick rate as seen in the update timestamps
+        tick_rates = [(bot.last_update[1] - bot.first_update[1]) / (bot.last_update[0] - bot.first_update[0])
+                      for bot in active if bot.last_update[0] > bot.first_update[0]]
+        updates = sum(bot.updates for bot in self.bots)
+        now = time.perf_counter()
+        expected = len(self.bots) * elapsed * BROADCAST_RATE
+        return {'bots':                 len(self.bots),
+                'logged_in':            sum(bot.logged_in or bot.updates > 0 for bot in self.bots),
+                'login_failed':         sum(bot.failed for bot in self.bots),
+                'seconds':              elapsed,
+                'server_tick_rate':     float(np.median(tick_rates)) if tick_rates else None,
+                'updates_per_second':   updates / elapsed / len(self.bots),
+                'update_loss':          max(0.0, 1 - updates / expected),
+                'update_gap_ms':        percentiles(gaps * 1000),
+                'input_latency_ms':     percentiles(latencies * 1000),
+                'unacked_inputs':       sum(now - sent > 1 for bot in self.bots for sent in bot.input_times.values()),
+                'bytes_in_per_client':  sum(bot.bytes_in for bot in self.bots) / elapsed / len(self.bots),
+                'bytes_out_per_client': sum(bot.bytes_out for bot in self.bots) / elapsed / len(self.bots)}
+
+
+def percentiles(values):
+    '''Get the 50th, 90th and 99th percentiles of some values'''
+    if np.isnan(values).all():
+        return None
+    return {'p50': float(np.nanpercentile(values, 50)), 'p90': float(np.nanpercentile(values, 90)),
+            'p99': float(np.nanpercentile(values, 99))}
+
+
+def serve_local(engine, port):
+    '''Run a server on localhost, in a child process'''
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if engine == 'asyncio':
+            from asyncserver import AsyncGameServer
+            server = AsyncGameServer()
+            server.run(('127.0.0.1', port))
+        else:
+            from headlessgameserver import HeadlessGameServer
+            server = HeadlessGameServer()
+            server.bind_address = lambda: ('127.0.0.1', port)
+            server.setup_server()
+            server.main_loop()
+
+
+def free_port():
+    '''Get a localhost UDP port nothing is bound to'''
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def print_report(report):
+    '''Print a report for people'''
+    def ms(values):
+        return 'n/a' if values is None else '%.0f / %.0f / %.0f ms' % (values['p50'], values['p90'], values['p99'])
+    print('bots:              %d (%d logged in, %d refused)' % (report['bots'], report['logged_in'], report['login_failed']))
+    print('server tick rate:  %s' % ('n/a' if report['server_tick_rate'] is None else '%.1f ticks/s' % report['server_tick_rate']))
+    print('updates:           %.1f /s per client, %.1f%% lost' % (report['updates_per_second'], report['update_loss'] * 100))
+    print('update gap:        %s (p50 / p90 / p99)' % ms(report['update_gap_ms']))
+    print('input latency:     %s (p50 / p90 / p99), %d inputs unacknowledged after 1 s' % (ms(report['input_latency_ms']), report['unacked_inputs']))
+    print('bytes per client:  %.0f B/s down, %.0f B/s up' % (report['bytes_in_per_client'], report['bytes_out_per_client']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the hide-and-seek server with a swarm of bots')
+    parser.add_argument('--address', default='%s:%d' % SERVER_ADDRESS, help='server or lobby address, host:port')
+    parser.add_argument('--local', choices=['threaded', 'asyncio'], nargs='?', const=SERVER_ENGINE,
+                        help='start a server on localhost to test against')
+    parser.add_argument('--bots', type=int, default=100, help='number of simulated clients')
+    parser.add_argument('--duration', type=float, default=10, help='seconds to measure for, after every bot logged in')
+    parser.add_argument('--ramp', type=float, default=200, help='logins per second')
+    parser.add_argument('--json', action='store_true', help='print the report as json')
+    args = parser.parse_args()
+
+    # every bot needs its own socket
+    if resource is not None:
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < args.bots + 100:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, args.bots + 100), hard))
+
+    server = None
+    if args.local:
+        address = ('127.0.0.1', free_port())
+        server = multiprocessing.Process(target=serve_local, args=(args.local, address[1]), daemon=True)
+        server.start()
+        time.sleep(1)
+    else:
+        host, port = args.address.rsplit(':', 1)
+        address = (host, int(port))
+
+    swarm = Swarm(address, args.bots)
+    report = asyncio.run(swarm.run(args.duration, args.ramp))
+    if server is not None:
+        server.terminate()
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print_report(report)
+
+if __name__ == "__main__":
+    main()
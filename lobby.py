@@ -0,0 +1,142 @@
+import asyncio
+import multiprocessing
+import os
+import socket
+import time
+
+import protocol
+from metrics import get_logger
+
+from config import *
+
+
+log = get_logger(__name__)
+
+
+def run_rooms(addresses, counts, mode=GAME_MODE):
+    '''Run some of the rooms in this worker process, all on one asyncio event loop
+
+    addresses maps the index of each room to run to the address it listens on'''
+    asyncio.run(serve_rooms(addresses, counts, mode))
+
+
+async def serve_rooms(addresses, counts, mode=GAME_MODE):
+    '''Serve the rooms and keep their player counts in the shared array up to date'''
+    # import here so only the workers create game servers
+    from asyncserver import AsyncGameServer
+
+    rooms = {index: AsyncGameServer() for index in addresses}
+    for room in rooms.values():
+        # the rooms of a worker would all want the same stats port, they only log
+        room.stats_address = None
+        room.mode = mode
+
+    async def report():
+        while True:
+            for index, room in rooms.items():
+                counts[index] = len(room.players)
+            await asyncio.sleep(0.5)
+
+    await asyncio.gather(report(), *(room.serve(addresses[index]) for index, room in rooms.items()))
+
+
+class Lobby:
+    '''Sends players to one of many game rooms running in worker processes
+
+    The lobby listens on SERVER_ADDRESS and answers each login with a
+    redirect to the port of a room with space left. Each room is a whole
+    AsyncGameServer with its own players and rounds. The rooms are spread
+    over worker processes, so a machine with many cores can host many rounds
+    at once. The workers share the player count of each room with the lobby
+    through an array in shared memory.'''
+    def __init__(self, rooms=ROOM_COUNT, capacity=ROOM_CAPACITY, workers=ROOM_WORKERS, mode=GAME_MODE):
+        '''Setup the lobby socket and the shared room counts'''
+        self.room_count = rooms
+        self.mode = mode
+        self.capacity = capacity
+        self.worker_count = min(workers or os.cpu_count() or 1, rooms)
+        self.workers = []
+        # player count of every room, written by the workers every half second
+        self.counts = multiprocessing.Array('i', rooms, lock=False)
+        # recent redirects the rooms have not counted yet, address -> (room, time)
+        self.pending = {}
+        # the counts as of the last login, to tell when redirected players arrive
+        self.reported = [0] * rooms
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def bind_address(self):
+        '''Get the local address the lobby listens on'''
+        return (socket.gethostbyname(socket.getfqdn()),SERVER_ADDRESS[1])
+
+    def setup_server(self):
+        '''Bind the lobby and start the worker processes running the rooms'''
+        self.socket.bind(self.bind_address())
+        host, port = self.socket.getsockname()
+        log.info("starting lobby at %s:%d", host, port)
+
+        log.info("starting %d rooms in %d workers", self.room_count, self.worker_count)
+        for worker in range(self.worker_count):
+            # deal the rooms out to the workers like cards
+            addresses = {index: (host, self.room_port(index)) for index in range(worker, self.room_count, self.worker_count)}
+            p = multiprocessing.Process(target=run_rooms, args=(addresses, self.counts, self.mode))
+            p.daemon = True # don't hang on exit
+            p.start()
+            self.workers.append(p)
+
+    def room_port(self, index):
+        '''Get the port of a room, the rooms listen on the ports right after the lobby'''
+        return self.socket.getsockname()[1] + 1 + index
+
+    def serve_forever(self):
+        '''Receive logins and redirect them to rooms'''
+        while True:
+            try:
+                data, address = self.socket.recvfrom(MAX_PACKET)
+                data = protocol.decode(data)
+            except ConnectionResetError:
+                continue
+            except protocol.ProtocolError:
+                # drop anything that is not a valid datagram
+                continue
+
+            # anything but a login is for a room the client hasn't switched to yet
+            if data['type'] != 'login':
+                continue
+            room = self.assign(address)
+            if room is None:
+                log.warning('no room left for: %s', data['username'])
+                self.socket.sendto(protocol.encode({'type':'login_ack', 'status':'bad'}), address)
+            else:
+                self.socket.sendto(protocol.encode({'type':'redirect', 'port':self.room_port(room)}), address)
+
+    def assign(self, address):
+        '''Pick a room for a player logging in from address, or None if every room is full
+
+        Players fill up the fullest room with space left, so rooms get the two
+        players they need to start a round as soon as possible.'''
+        now = time.time()
+        load = list(self.counts)
+        # a room that counted more players has seen the oldest of its redirected players log in
+        joined = [max(0, count - reported) for count, reported in zip(load, self.reported)]
+        self.reported = list(load)
+        pending = {}
+        for a, (room, t) in self.pending.items():
+            if joined[room]:
+                joined[room] -= 1
+            elif now - t < REDIRECT_TIMEOUT:
+                pending[a] = (room, t)
+        self.pending = pending
+        # a client resending its login gets the same room again
+        if address in self.pending:
+            return self.pending[address][0]
+
+        for room, _ in self.pending.values():
+            load[room] += 1
+        # skip the rooms of workers that died
+        alive = [p.is_alive() for p in self.workers]
+        rooms = [i for i in range(self.room_count) if load[i] < self.capacity and alive[i % self.worker_count]]
+        if not rooms:
+            return None
+        room = max(rooms, key=lambda i: load[i])
+        self.pending[address] = (room, now)
+        return room
@@ -0,0 +1,47 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import *
+
+
+class MapCache:
+    '''A bounded LRU cache of built maps keyed by seed
+
+    Maps are built on a background worker thread, so a seed can be prefetched
+    while the current round is still running and picked up with get() later
+    without doing any generation work on the caller's thread.'''
+    def __init__(self, build, size=MAP_CACHE_SIZE):
+        '''build is a function taking a seed and returning the map for it'''
+        self.build = build
+        self.size = size
+        # seed -> Future of the built map, least recently used first
+        self.maps = OrderedDict()
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mapgen')
+
+    def prefetch(self, seed):
+        '''Start building the map for a seed in the background and return its Future'''
+        with self.lock:
+            future = self.maps.get(seed)
+            if future is None:
+                future = self.executor.submit(self.build, seed)
+                self.maps[seed] = future
+                # evicted maps that are still building finish for whoever holds their Future
+                while len(self.maps) > self.size:
+                    self.maps.popitem(last=False)
+            else:
+                self.maps.move_to_end(seed)
+            return future
+
+    def get(self, seed):
+        '''Get the map for a seed, waiting for it to be built if it is not ready yet'''
+        future = self.prefetch(seed)
+        try:
+            return future.result()
+        except Exception:
+            # don't keep a failed build around
+            with self.lock:
+                if self.maps.get(seed) is future:
+                    del self.maps[seed]
+            raise
@@ -0,0 +1,57 @@
+from collections import OrderedDict
+
+import pygame
+
+from config import *
+
+
+class MapLayer:
+    '''A map's walls drawn once into tiles, for blitting the part under the camera
+
+    The maze is cut into squares of tile_size pixels. Each tile is drawn the
+    first time it comes on screen, with only the walls the grid index puts
+    in it, and kept for later frames. At most cache_size tiles are kept, the
+    least recently used are dropped, so huge maps don't take up all the
+    memory. A frame costs a few blits however big the map is.'''
+    def __init__(self, walls, tile_size=MAP_TILE_SIZE, cache_size=MAP_TILE_CACHE, color=WALL_COLOR, width=WALL_WIDTH):
+        '''walls is the Walls object of the map'''
+        self.walls = walls
+        self.tile_size = tile_size
+        self.cache_size = cache_size
+        self.color = color
+        self.width = width
+        # (column, row) -> tile surface, least recently used first
+        self.tiles = OrderedDict()
+
+    def tile(self, column, row):
+        '''Get the surface of a tile, drawing it if it isn't cached'''
+        key = (column, row)
+        surface = self.tiles.get(key)
+        if surface is not None:
+            self.tiles.move_to_end(key)
+            return surface
+
+        surface = pygame.Surface((self.tile_size, self.tile_size))
+        if pygame.display.get_surface() is not None:
+            # the display's pixel format blits fastest
+            surface = surface.convert()
+        left, top = column * self.tile_size, row * self.tile_size
+        # walls just outside the tile can still reach in by their line width
+        pad = self.width
+        visible = self.walls.query_rect(left - pad, top - pad, left + self.tile_size + pad, top + self.tile_size + pad)
+        for x1, y1, x2, y2 in self.walls.walls[visible]:
+            pygame.draw.line(surface, self.color, (x1 - left, y1 - top), (x2 - left, y2 - top), self.width)
+
+        self.tiles[key] = surface
+        while len(self.tiles) > self.cache_size:
+            self.tiles.popitem(last=False)
+        return surface
+
+    def blit(self, surface, left, top):
+        '''Draw the part of the map with its top left corner at (left, top) onto surface'''
+        left, top = int(left), int(top)
+        width, height = surface.get_size()
+        size = self.tile_size
+        for row in range(top // size, (top + height - 1) // size + 1):
+            for column in range(left // size, (left + width - 1) // size + 1):
+                surface.blit(self.tile(column, row), (column * size - left, row * size - top))
@@ -5,57 +5,55 @@
 import random
 import pickle
 
+import numpy as np
+
+from config import CELL_SIZE
+
 # Create a maze using the depth-first algorithm described at
 # https://scipython.com/blog/making-a-maze/
 # Christian Hill, April 2017.
 
-class Cell:
-    """A cell in the maze.
-
-    A maze "Cell" is a point in the grid which may be surrounded by walls to
-    the north, east, south or west.
-
-    """
-
-    # A wall separates a pair of cells in the N-S or W-E directions.
-    wall_pairs = {'N': 'S', 'S': 'N', 'E': 'W', 'W': 'E'}
+# Each cell's walls are stored as a bitmask of these directions.
+N, S, E, W = 1, 2, 4, 8
+ALL_WALLS = N | S | E | W
+DIRECTIONS = {'N': N, 'S': S, 'E': E, 'W': W}
 
-    def __init__(self, x, y):
-        """Initialize the cell at (x,y). At first it is surrounded by walls."""
 
-        self.x, self.y = x, y
-        self.walls = {'N': True, 'S': True, 'E': True, 'W': True}
+def runs(grid):
+    '''Find the runs of True values along each row of a 2D boolean array
 
-    def has_all_walls(self):
-        """Does this cell still have all its walls?"""
+    Returns arrays of (row, first index, last index) for every run, in row order.'''
+    padded = np.zeros((grid.shape[0], grid.shape[1]+2), dtype=np.int8)
+    padded[:,1:-1] = grid
+    edges = np.diff(padded, axis=1)
+    row, first = np.nonzero(edges == 1)
+    _, end = np.nonzero(edges == -1)
+    return row, first, end-1
 
-        return all(self.walls.values())
 
-    def knock_down_wall(self, other, wall):
-        """Knock down the wall between cells self and other."""
-
-        self.walls[wall] = False
-        other.walls[Cell.wall_pairs[wall]] = False
+class Maze:
+    """A Maze, represented as a grid of cells.
 
+    The walls of cell (x,y) are a bitmask of N, S, E and W stored at index
+    x*ny + y of a flat bytearray.
 
-class Maze:
-    """A Maze, represented as a grid of cells."""
+    """
 
     def __init__(self, nx, ny, ix=0, iy=0):
         """Initialize the maze grid.
         The maze consists of nx x ny cells and will be constructed starting
-        at the cell indexed at (ix, iy).
+        at the cell indexed at (ix, iy). At first every cell is surrounded by walls.
 
         """
 
         self.nx, self.ny = nx, ny
         self.ix, self.iy = ix, iy
-        self.maze_map = [[Cell(x, y) for y in range(ny)] for x in range(nx)]
+        self.walls = bytearray([ALL_WALLS]) * (nx * ny)
 
-    def cell_at(self, x, y):
-        """Return the Cell object at (x,y)."""
+    def has_wall(self, x, y, direction):
+        """Does the cell at (x,y) have a wall in direction 'N', 'S', 'E' or 'W'?"""
 
-        return self.maze_map[x][y]
+        return bool(self.walls[x*self.ny + y] & DIRECTIONS[direction])
 
     def __str__(self):
         """Return a (crude) string representation of the maze."""
@@ -64,14 +62,14 @@ class Maze:
         for y in range(self.ny):
             maze_row = ['|']
             for x in range(self.nx):
-                if self.maze_map[x][y].walls['E']:
+                if self.has_wall(x, y, 'E'):
                     maze_row.append(' |')
                 else:
                     maze_row.append('  ')
             maze_rows.append(''.join(maze_row))
             maze_row = ['|']
             for x in range(self.nx):
-                if self.maze_map[x][y].walls['S']:
+                if self.has_wall(x, y, 'S'):
                     maze_row.append('-+')
                 else:
                     maze_row.append(' +')
@@ -79,84 +77,134 @@ class Maze:
         return '\n'.join(maze_rows)
 
 
-    def get_wall_list(self):
+    def get_wall_list(self, merge=True):
         '''Get a wall list representation of the Maze
-        
-        Adds walls around the left and bottom border. 
+
+        Adds walls around the left and bottom border.
         Clears out a path in the straight N,E,S,W directions
-        TODO combine stretches of walls into a single wall'''
 
-        CELL_SIZE = 50
+        By default runs of collinear, touching walls are combined into a single
+        wall and the result is a compact (n,4) integer array. merge=False gives
+        the original list with one wall per cell edge.'''
+
+        if merge:
+            return self.get_merged_walls()
+
         walls = []
+        east, south = self.get_wall_grids()
 
         for y in range(self.ny):
             for x in range(self.nx):
-                if not (2/5*self.nx < x < 3/5*self.nx) or not (2/5*self.ny < y < 3/5*self.ny):
-                    if self.maze_map[x][y].walls['E'] and (y != self.ny//2 or x == 0 or x == self.nx-1) :
-                        walls.append([x*CELL_SIZE,y*CELL_SIZE,x*CELL_SIZE,(y-1)*CELL_SIZE])
-                    if self.maze_map[x][y].walls['S'] and (x != self.nx//2 or y == 0 or y == self.ny-1):
-                        walls.append([x*CELL_SIZE,y*CELL_SIZE,(x-1)*CELL_SIZE,y*CELL_SIZE])
-        
+                if east[x,y]:
+                    walls.append([x*CELL_SIZE,y*CELL_SIZE,x*CELL_SIZE,(y-1)*CELL_SIZE])
+                if south[x,y]:
+                    walls.append([x*CELL_SIZE,y*CELL_SIZE,(x-1)*CELL_SIZE,y*CELL_SIZE])
+
         walls.append([-CELL_SIZE,-CELL_SIZE,(self.nx-1)*CELL_SIZE,-CELL_SIZE])
         walls.append([-CELL_SIZE,-CELL_SIZE,-CELL_SIZE,(self.ny-1)*CELL_SIZE])
 
 
         return walls
-    
+
+    def get_wall_grids(self):
+        '''Get (nx,ny) boolean arrays of the E and S walls that make it into the wall list'''
+        cells = np.frombuffer(bytes(self.walls), dtype=np.uint8).reshape(self.nx, self.ny)
+        east = (cells & E) != 0
+        south = (cells & S) != 0
+
+        # the cleared out center and the straight paths through it
+        x, y = np.meshgrid(np.arange(self.nx), np.arange(self.ny), indexing='ij')
+        center = (2/5*self.nx < x) & (x < 3/5*self.nx) & (2/5*self.ny < y) & (y < 3/5*self.ny)
+        east &= ~center & ((y != self.ny//2) | (x == 0) | (x == self.nx-1))
+        south &= ~center & ((x != self.nx//2) | (y == 0) | (y == self.ny-1))
+        return east, south
+
+    def get_merged_walls(self):
+        '''Get the wall list with collinear, touching walls combined
+
+        The E wall of cell (x,y) runs from y-1 to y on the line x, and the S wall
+        runs from x-1 to x on the line y, so a run of consecutive cells with the
+        same wall becomes one wall from the first cell-1 to the last cell.'''
+        east, south = self.get_wall_grids()
+
+        # vertical runs along y of east walls, then horizontal runs along x of south walls
+        line, first, last = runs(east)
+        vertical = np.stack([line, first-1, line, last], axis=1)
+        line, first, last = runs(south.T)
+        horizontal = np.stack([first-1, line, last, line], axis=1)
+        border = np.array([[-1,-1,self.nx-1,-1],
+                           [-1,-1,-1,self.ny-1]])
+
+        # int16 is enough for every map with coordinates below 32768 pixels
+        dtype = np.int16 if (max(self.nx, self.ny)+1)*CELL_SIZE < 2**15 else np.int32
+        return (np.concatenate([vertical, horizontal, border]) * CELL_SIZE).astype(dtype)
+
     def write_to_file(self, filename):
         with open(filename, 'wb') as f:
             pickle.dump(self.get_wall_list(), f)
-            
+
     @staticmethod
     def load_from_file(filename):
         with open(filename, 'rb') as f:
             return pickle.load(f)
-        
-
-    def find_valid_neighbours(self, cell):
-        """Return a list of unvisited neighbours to cell."""
-
-        delta = [('W', (-1, 0)),
-                 ('E', (1, 0)),
-                 ('S', (0, 1)),
-                 ('N', (0, -1))]
-        neighbours = []
-        for direction, (dx, dy) in delta:
-            x2, y2 = cell.x + dx, cell.y + dy
-            if (0 <= x2 < self.nx) and (0 <= y2 < self.ny):
-                neighbour = self.cell_at(x2, y2)
-                if neighbour.has_all_walls():
-                    neighbours.append((direction, neighbour))
-        return neighbours
 
     def make_maze(self, seed):
-        
-        # set random seed 
+        '''Carve the maze with a seeded depth-first search
+
+        Neighbours are considered in W, E, S, N order and picked with the same
+        random calls as the original Cell based version, so a seed always
+        produces the same maze.'''
+
+        # set random seed
         myrandom = random.Random()
         myrandom.seed(seed)
+        choice = myrandom.choice
+
+        # carve in a copy padded with a border of cells that never look unvisited,
+        # so finding neighbours needs no bounds checks
+        stride = self.ny + 2
+        walls = bytearray((self.nx+2) * stride)
+        for x in range(self.nx):
+            walls[(x+1)*stride+1:(x+2)*stride-1] = self.walls[x*self.ny:(x+1)*self.ny]
+        # the walls to clear in the current and next cell for each step
+        knock = {-stride: (~W, ~E), stride: (~E, ~W), 1: (~S, ~N), -1: (~N, ~S)}
 
         # Total number of cells.
         n = self.nx * self.ny
         cell_stack = []
-        current_cell = self.cell_at(self.ix, self.iy)
+        current = (self.ix+1)*stride + self.iy+1
         # Total number of visited cells during maze construction.
         nv = 1
 
         while nv < n:
-            neighbours = self.find_valid_neighbours(current_cell)
+            # find the steps to the unvisited neighbours
+            neighbours = []
+            if walls[current-stride] == ALL_WALLS:
+                neighbours.append(-stride)
+            if walls[current+stride] == ALL_WALLS:
+                neighbours.append(stride)
+            if walls[current+1] == ALL_WALLS:
+                neighbours.append(1)
+            if walls[current-1] == ALL_WALLS:
+                neighbours.append(-1)
 
             if not neighbours:
                 # We've reached a dead end: backtrack.
-                current_cell = cell_stack.pop()
+                current = cell_stack.pop()
                 continue
 
-            # Choose a random neighbouring cell and move to it.
-            direction, next_cell = myrandom.choice(neighbours)
-            current_cell.knock_down_wall(next_cell, direction)
-            cell_stack.append(current_cell)
-            current_cell = next_cell
+            # Choose a random neighbouring cell and knock down the wall between them.
+            step = choice(neighbours)
+            wall, opposite = knock[step]
+            walls[current] &= wall
+            cell_stack.append(current)
+            current += step
+            walls[current] &= opposite
             nv += 1
 
+        for x in range(self.nx):
+            self.walls[x*self.ny:(x+1)*self.ny] = walls[(x+1)*stride+1:(x+2)*stride-1]
+
 def main():
     '''generate a test map and save it in map1.txt'''
     # maze = Maze(nx, ny, ix, iy)
@@ -164,8 +212,9 @@ def main():
     maze.make_maze(1)
 
     # print(maze)
+    print(len(maze.get_wall_list(merge=False)), 'walls,', len(maze.get_wall_list()), 'merged')
     print(maze.get_wall_list()[:10])
     # maze.write_to_file('map1.txt')
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
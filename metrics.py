@@ -0,0 +1,173 @@
+import bisect
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# upper bounds in seconds of the histogram buckets, the last one catches everything slower
+DURATION_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, float('inf'))
+
+
+class Histogram:
+    '''Counts of durations in fixed buckets
+
+    Observing is a bisect and two additions, cheap enough for every tick
+    and every update sent.'''
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value):
+        '''Count one duration in seconds'''
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        '''Get the upper bound of the bucket a percentile falls in, None if nothing was observed'''
+        if not self.count:
+            return None
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= fraction * self.count:
+                # the slowest bucket has no upper bound, the max is the best guess
+                return self.max if bound == float('inf') else bound
+        return self.max
+
+    def stats(self):
+        '''Get the histogram as a dict, in milliseconds'''
+        def ms(value):
+            return None if value is None else value * 1000
+        return {'count':   self.count,
+                'mean_ms': ms(self.total / self.count) if self.count else None,
+                'p50_ms':  ms(self.percentile(0.5)),
+                'p99_ms':  ms(self.percentile(0.99)),
+                'max_ms':  ms(self.max),
+                'buckets': {('<=%gms' % (bound * 1000)) if bound != float('inf') else 'slower': count
+                            for bound, count in zip(self.buckets, self.counts)}}
+
+
+class ServerMetrics:
+    '''Counters and timings of a game server
+
+    The serve, tick and broadcast threads only add to counters here, the
+    rates are worked out from them once per window by roll(). The counters
+    aren't locked, a race may lose an increment now and then which is fine
+    for statistics.'''
+    def __init__(self, window=1, clock=time.perf_counter):
+        self.window = window
+        self.clock = clock
+        self.start = clock()
+        self.tick_seconds = Histogram()
+        self.encode_seconds = Histogram()
+        self.packets_in = 0
+        self.bytes_in = 0
+        # packets received of each message type
+        self.received = {}
+        self.packets_out = 0
+        self.bytes_out = 0
+        self.updates_sent = 0
+        # the counters at the start of the current window and the rates over the last one
+        self.window_start = self.start
+        self.window_counts = self.counters()
+        self.rates = {}
+
+    def counters(self):
+        '''Get the counters rates are worked out from'''
+        return {'packets_in': self.packets_in, 'bytes_in': self.bytes_in,
+                'packets_out': self.packets_out, 'bytes_out': self.bytes_out,
+                'updates_sent': self.updates_sent, 'ticks': self.tick_seconds.count}
+
+    def roll(self):
+        '''Work out the per second rates when a window is over, call this often'''
+        now = self.clock()
+        if now - self.window_start < self.window:
+            return False
+        counts = self.counters()
+        elapsed = now - self.window_start
+        self.rates = {name: (counts[name] - self.window_counts[name]) / elapsed for name in counts}
+        self.window_start = now
+        self.window_counts = counts
+        return True
+
+    def stats(self):
+        '''Get the metrics as a dict'''
+        return {'uptime':            self.clock() - self.start,
+                'per_second':        self.rates,
+                'packets_in':        self.packets_in,
+                'bytes_in':          self.bytes_in,
+                'received':          dict(self.received),
+                'packets_out':       self.packets_out,
+                'bytes_out':         self.bytes_out,
+                'updates_sent':      self.updates_sent,
+                'tick_seconds':      self.tick_seconds.stats(),
+                'encode_seconds':    self.encode_seconds.stats()}
+
+
+class RateLimitFilter(logging.Filter):
+    '''Lets through at most burst records with the same message every period seconds
+
+    Add it to the logger of a module that logs in a hot path. The next
+    record let through after some were dropped says how many.'''
+    def __init__(self, burst=5, period=1, clock=time.monotonic):
+        logging.Filter.__init__(self)
+        self.burst = burst
+        self.period = period
+        self.clock = clock
+        # message format -> [window start, records let through, records dropped]
+        self.windows = {}
+
+    def filter(self, record):
+        now = self.clock()
+        window = self.windows.get(record.msg)
+        if window is None or now - window[0] >= self.period:
+            dropped = window[2] if window else 0
+            window = self.windows[record.msg] = [now, 0, 0]
+            if dropped:
+                record.msg = '%s (%d similar messages suppressed)' % (record.msg, dropped)
+        if window[1] >= self.burst:
+            window[2] += 1
+            return False
+        window[1] += 1
+        return True
+
+
+def get_logger(name):
+    '''Get the logger of a module, rate limited'''
+    log = logging.getLogger(name)
+    if not any(isinstance(f, RateLimitFilter) for f in log.filters):
+        log.addFilter(RateLimitFilter())
+    return log
+
+
+def serve_stats(address, stats):
+    '''Answer http GET requests on address with the json of stats(), in a daemon thread
+
+    meant for localhost, e.g. curl http://127.0.0.1:9101/'''
+    class StatsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps(stats()).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # don't log every scrape
+            pass
+
+    httpd = ThreadingHTTPServer(address, StatsHandler)
+    httpd.daemon_threads = True
+    t = threading.Thread(target=httpd.serve_forever)
+    t.daemon = True # don't hang on exit
+    t.start()
+    return httpd
@@ -1,21 +1,26 @@
-
 import random 
-import numpy as np
 
+from collision import as_walls
+from rect import Rect
 from config import *
 
-class Player:
-    '''Player object containing important information about a player.'''
+class PlayerState:
+    '''The state of a player that is simulated and sent in updates
+
+    Uses __slots__ so the server's many players stay small and quick to read.
+    role is one of the *_ROLE ints and inputs is a bitmask of the keys held.'''
+    __slots__ = ('username', 'id', 'score', 'role', 'location', 'inputs', 'speed', 'color', 'bgcolor', 'size')
+
     def __init__(self, location, username):
-        '''Setup the player object'''
+        '''Setup the player state'''
         # for multiplayer functions
         self.username = username
-        self.address = None
+        self.id = None
         self.score = 0
-        self.role = "ghost"
+        self.role = GHOST_ROLE
         # player movement variables
         self.location = location
-        self.inputs = set()
+        self.inputs = 0
         self.speed = 10
         # set the color and size of the player
         self.color = (random.randint(100,255), random.randint(100,255), random.randint(100,255))
@@ -24,65 +29,59 @@ class Player:
 
     def __str__(self):
         '''Return a stringified copy of this player'''
-        return "username:"+self.username+", location:"+str(self.location)+", inputs:"+str(self.inputs)
+        return "username:"+self.username+", location:"+str(self.location)+", inputs:"+bin(self.inputs)
 
-    def handle_event(self, event):
-        '''an event is passed to the client
-        
-        when an arrow key is pressed or released, the inputs variable is updated with the current inputs'''
-        if event.type in [pygame.KEYDOWN, pygame.KEYUP] and event.key in CLIENT_ARROW_KEYS:
-            self.inputs = set()
-            keys = pygame.key.get_pressed()
-            for key in CLIENT_ARROW_KEYS:
-                if keys[key]:
-                    self.inputs.add(CLIENT_TO_PROTOCOL[key])
+    def get_step(self):
+        '''Get the desired change in position, (dx,dy), from the current inputs'''
+        inputs = self.inputs
+        dx = ((inputs >> RIGHT_KEY & 1) - (inputs >> LEFT_KEY & 1)) * self.speed
+        dy = ((inputs >> DOWN_KEY & 1) - (inputs >> UP_KEY & 1)) * self.speed
+        return dx, dy
 
     def update_location(self,walls):
         '''Updates the location of this player
         
         Given a set of walls and player inputs, apply a change to the position of this player'''
         # calculate the desired change in position, (dx,dy)
-        dx = dy = 0
-        for i in self.inputs:
-            if i == UP_KEY:
-                dy -= self.speed
-            elif i == DOWN_KEY:
-                dy += self.speed
-            elif i == LEFT_KEY:
-                dx -= self.speed 
-            elif i == RIGHT_KEY:
-                dx += self.speed 
+        dx, dy = self.get_step()
 
         # check if the player is allowed to move into the new spot
         newspot = [self.location[0] + dx, self.location[1] + dy]
-        if self.role == 'ghost' or ((dy != 0 or dx != 0) and not self.wallcollide(self.location+newspot,walls)):
+        if self.role == GHOST_ROLE or ((dy != 0 or dx != 0) and not self.wallcollide(list(self.location)+newspot,walls)):
             self.location = newspot
 
     def wallcollide(self, step_vector, walls):
         '''Check if a step intersects a wall
 
-        using math from: https://en.wikipedia.org/wiki/Line%E2%80%93line_intersection'''
-
-        x1,y1,x2,y2 = step_vector 
-        for wall in walls:
-            x3,y3,x4,y4 = wall 
+        walls may be a collision.Walls object or a plain list of (x1,y1,x2,y2) walls'''
+        return as_walls(walls).collide(step_vector)
+    
+    def get_rect(self, location=None):
+        '''get a rect representing the player, used for collision checking
 
-            denom = np.linalg.det([[x1-x2,x3-x4],[y1-y2,y3-y4]])
-            if denom == 0: # parallel or coincedent
-                continue 
+        location may be an earlier location of the player, it defaults to the current one.
+        It is a rect.Rect, which acts like a pygame.Rect, so the server runs without pygame'''
+        x, y = self.location if location is None else location
+        size = int(self.size*2.5)
+        # centered on the location rounded half away from zero, like setting pygame.Rect.center
+        return Rect((int(x + 0.5) if x >= 0 else -int(0.5 - x)) - size//2,
+                    (int(y + 0.5) if y >= 0 else -int(0.5 - y)) - size//2, size, size)
 
-            t = np.linalg.det([[x1-x3,x3-x4],[y1-y3,y3-y4]]) / denom
-            u = -np.linalg.det([[x1-x2,x1-x3],[y1-y2,y1-y3]]) / denom
 
-            # if there is an intersection
-            # (check if 0<t represents that there is no collision if the players path starts on a wall)
-            if 0 < t <= 1 and 0 <= u <= 1:
-                return True 
+class Player(PlayerState):
+    '''Player object containing important information about a player.
 
-        return False
-    
-    def get_rect(self):
-        '''get a rect representing the player, used for collision checking'''
-        rect = pygame.Rect(0,0,int(self.size*2.5),int(self.size*2.5))
-        rect.center = tuple(self.location)
-        return rect
+    The client's players, they can hold any presentation data the client needs.'''
+    def handle_event(self, event):
+        '''an event is passed to the client
+        
+        when an arrow key is pressed or released, the inputs variable is updated with the current inputs'''
+        # only the client gets here, importing these at the top would load pygame on the server too
+        import pygame
+        from clientkeys import CLIENT_ARROW_KEYS, CLIENT_TO_PROTOCOL
+        if event.type in [pygame.KEYDOWN, pygame.KEYUP] and event.key in CLIENT_ARROW_KEYS:
+            self.inputs = 0
+            keys = pygame.key.get_pressed()
+            for key in CLIENT_ARROW_KEYS:
+                if keys[key]:
+                    self.inputs |= 1 << CLIENT_TO_PROTOCOL[key]
@@ -0,0 +1,76 @@
+import numpy as np
+
+from config import *
+
+
+class PlayerTable:
+    '''The players' positions, speeds, roles and inputs as numpy arrays, for stepping everyone at once
+
+    Row i is the i-th player passed to load(). The arrays are kept between
+    ticks and only grow, so a tick allocates nothing per player. step() does
+    the movement of Player.update_location for every row in a few array
+    operations and one batched wall check.'''
+    def __init__(self, capacity=64):
+        self.count = 0
+        self.location = np.zeros((capacity, 2))
+        self.speed = np.zeros(capacity)
+        self.role = np.zeros(capacity, dtype=np.int8)
+        self.inputs = np.zeros(capacity, dtype=np.uint8)
+
+    def grow(self, capacity):
+        '''Make room for capacity rows, at least doubling the arrays'''
+        capacity = max(capacity, 2 * len(self.speed))
+        for name in ('location', 'speed', 'role', 'inputs'):
+            old = getattr(self, name)
+            new = np.zeros((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def load(self, players):
+        '''Copy the state of a list of players into the first rows'''
+        count = self.count = len(players)
+        if count > len(self.speed):
+            self.grow(count)
+        if not count:
+            return
+        self.location[:count] = [player.location for player in players]
+        self.speed[:count] = [player.speed for player in players]
+        self.role[:count] = [player.role for player in players]
+        self.inputs[:count] = [player.inputs for player in players]
+
+    def step(self, walls, frozen_role=None):
+        '''Move every loaded player by one tick of its inputs, returns the rows that moved
+
+        ghosts go through walls, everyone else stays put if its step hits one.
+        Players with frozen_role don't move at all, like the seeker while the
+        hiders hide.'''
+        count = self.count
+        location = self.location[:count]
+        speed = self.speed[:count]
+        role = self.role[:count]
+        inputs = self.inputs[:count]
+
+        # the same sums of held keys as Player.get_step
+        step = np.empty((count, 2))
+        step[:,0] = ((inputs >> RIGHT_KEY & 1).astype(np.float64) - (inputs >> LEFT_KEY & 1)) * speed
+        step[:,1] = ((inputs >> DOWN_KEY & 1).astype(np.float64) - (inputs >> UP_KEY & 1)) * speed
+
+        moving = (step != 0).any(axis=1)
+        if frozen_role is not None:
+            moving &= role != frozen_role
+        ghost = role == GHOST_ROLE
+        moved = moving & ghost
+        checked = np.flatnonzero(moving & ~ghost)
+        if len(checked):
+            start = location[checked]
+            blocked = walls.collide_many(np.concatenate([start, start + step[checked]], axis=1))
+            moved[checked[~blocked]] = True
+
+        rows = np.flatnonzero(moved)
+        location[rows] += step[rows]
+        return rows
+
+    def store(self, players, rows):
+        '''Copy the new locations of some rows back to their players'''
+        for row, location in zip(rows.tolist(), self.location[rows].tolist()):
+            players[row].location = location
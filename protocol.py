@@ -0,0 +1,336 @@
+'''Binary wire protocol shared by the server and the clients
+
+Every datagram starts with a (version, type) header followed by a fixed
+struct layout for its type. Messages are passed around as the same dicts
+the game used to pickle, with a 'type' key naming the message, so encode()
+and decode() are drop-in replacements for pickle.dumps and pickle.loads.
+
+  login       :- username, timestamp
+  login_ack   :- status, id
+  inputs      :- inputs, seq, timestamp
+  update      :- baseline, players, local, removed, hidden, game_state, map_seed, next_map_seed, timestamp,
+                 ack_seq, ack_ticks
+  update_ack  :- ack, timestamp
+  fragment    :- message_id, index, count, data
+  redirect    :- port
+  kick
+
+An update is a delta against the snapshot with timestamp baseline (see
+snapshots.py), or a full snapshot when baseline is -1. Each entry in players
+(the scoreboard part, the same for every client) and local (the positions of
+the players in the client's area of interest) holds the id plus only the
+fields that changed, marked by a field bitmask. removed players are gone and
+hidden players left the area of interest.
+
+Datagrams longer than MTU are sent as numbered fragments and put back
+together by a Reassembler.
+
+Inputs are numbered by the client. Each update echoes the seq of the
+newest inputs the server applied for that client (ack_seq) and how many
+ticks it has simulated with them (ack_ticks), so the client can replay
+the rest of its predicted movement on top of the server's position.
+
+Roles are sent as their *_ROLE ints and inputs as the bitmask the players
+keep them in (see config.py).
+
+When the server runs a lobby (lobby.py), it answers a login with a redirect
+to the port of the room the client should log in to instead.
+'''
+import struct
+from collections import OrderedDict
+
+from config import *
+from snapshots import FIELDS
+
+VERSION = 2
+
+# message type codes
+LOGIN = 1
+LOGIN_ACK = 2
+INPUTS = 3
+# 4 was inputs_ack, updates acknowledge inputs with ack_seq now
+UPDATE = 5
+KICK = 6
+UPDATE_ACK = 7
+FRAGMENT = 8
+REDIRECT = 9
+TYPES = {'login': LOGIN, 'login_ack': LOGIN_ACK, 'inputs': INPUTS,
+         'update': UPDATE, 'kick': KICK, 'update_ack': UPDATE_ACK,
+         'fragment': FRAGMENT, 'redirect': REDIRECT}
+TYPE_NAMES = {code: name for name, code in TYPES.items()}
+
+# small integer codes for the strings sent in updates
+STATES = ['waiting', 'hiding', 'seeking']
+STATUSES = ['bad', 'ok']
+
+HEADER = struct.Struct('!BB')                 # version, type
+LOGIN_FORMAT = struct.Struct('!IB')           # timestamp, username length
+LOGIN_ACK_FORMAT = struct.Struct('!BH')       # status, player id
+INPUTS_FORMAT = struct.Struct('!BII')         # inputs bitmask, inputs seq, timestamp
+UPDATE_ACK_FORMAT = struct.Struct('!II')      # acked update timestamp, timestamp
+UPDATE_FORMAT = struct.Struct('!BiIIIIH')     # state, baseline, map seed, next map seed, timestamp, ack seq, ack ticks
+PLAYER_FORMAT = struct.Struct('!HB')          # id, changed field bitmask
+COUNT_FORMAT = struct.Struct('!H')            # number of players or ids in a section
+ID_FORMAT = struct.Struct('!H')               # removed or hidden player id
+FRAGMENT_FORMAT = struct.Struct('!IBB')       # message id, fragment index, fragment count
+REDIRECT_FORMAT = struct.Struct('!H')         # room port
+
+# the struct format of each fixed-size player field, in snapshots.FIELDS order;
+# the username comes last as length-prefixed text
+FIELD_FORMATS = {'location': 'ff',
+                 'role':     'B',
+                 'score':    'H',
+                 'inputs':   'B',
+                 'color':    '3B',
+                 'bgcolor':  '3B',
+                 'username': 'B'}
+FIELD_BITS = {field: 1 << i for i, field in enumerate(FIELDS)}
+# the structs of the fixed-size fields present for each changed field bitmask
+MASK_FORMATS = {}
+
+class ProtocolError(ValueError):
+    '''Raised when a datagram can not be decoded'''
+
+
+def encode_text(text):
+    '''utf-8 encode a short string, truncated to fit a one byte length'''
+    # drop any character cut in half by the truncation
+    return text.encode('utf-8')[:255].decode('utf-8', 'ignore').encode('utf-8')
+
+
+def encode(message):
+    '''Encode a message dict as a datagram'''
+    kind = message['type']
+    if kind not in TYPES:
+        raise ProtocolError('unknown message type: %r' % kind)
+    header = HEADER.pack(VERSION, TYPES[kind])
+
+    if kind == 'login':
+        username = encode_text(message['username'])
+        return header + LOGIN_FORMAT.pack(message['timestamp'], len(username)) + username
+    if kind == 'login_ack':
+        return header + LOGIN_ACK_FORMAT.pack(STATUSES.index(message['status']), message.get('id', 0))
+    if kind == 'inputs':
+        return header + INPUTS_FORMAT.pack(message['inputs'], message['seq'], message['timestamp'])
+    if kind == 'update_ack':
+        return header + UPDATE_ACK_FORMAT.pack(message['ack'], message['timestamp'])
+    if kind == 'update':
+        return encode_update(message)
+    if kind == 'fragment':
+        return header + FRAGMENT_FORMAT.pack(message['message_id'], message['index'], message['count']) + message['data']
+    if kind == 'redirect':
+        return header + REDIRECT_FORMAT.pack(message['port'])
+    # kick has no body
+    return header
+
+
+def encode_update(message, players=None):
+    '''Encode an update message
+
+    players may be the already encoded scoreboard section from encode_players,
+    so it only has to be encoded once when it is shared by many clients'''
+    if players is None:
+        players = encode_players(message['players'])
+    return b''.join([HEADER.pack(VERSION, UPDATE),
+                     UPDATE_FORMAT.pack(STATES.index(message['game_state']), message['baseline'],
+                                        message['map_seed'], message['next_map_seed'], message['timestamp'],
+                                        message['ack_seq'], min(message['ack_ticks'], 0xFFFF)),
+                     players,
+                     encode_players(message['local']),
+                     encode_ids(message['removed']),
+                     encode_ids(message['hidden'])])
+
+
+def encode_players(players):
+    '''Encode a section of player changes'''
+    return COUNT_FORMAT.pack(len(players)) + b''.join(encode_player(player) for player in players)
+
+
+def encode_ids(ids):
+    '''Encode a section of player ids'''
+    return COUNT_FORMAT.pack(len(ids)) + b''.join(ID_FORMAT.pack(player_id) for player_id in ids)
+
+
+def fragment(data, message_id, mtu=MTU):
+    '''Split a datagram into fragment datagrams of at most mtu bytes, or return it alone if it fits'''
+    if len(data) <= mtu:
+        return [data]
+    size = mtu - HEADER.size - FRAGMENT_FORMAT.size
+    chunks = [data[i:i+size] for i in range(0, len(data), size)]
+    if len(chunks) > 255:
+        raise ProtocolError('datagram too large to fragment: %d bytes' % len(data))
+    return [encode({'type': 'fragment', 'message_id': message_id % 2**32, 'index': i,
+                    'count': len(chunks), 'data': chunk}) for i, chunk in enumerate(chunks)]
+
+
+def mask_format(mask):
+    '''Get the struct packing the id, bitmask and fields present in a changed field bitmask'''
+    if mask not in MASK_FORMATS:
+        MASK_FORMATS[mask] = struct.Struct('!HB' + ''.join(FIELD_FORMATS[field] for field in FIELDS if mask & FIELD_BITS[field]))
+    return MASK_FORMATS[mask]
+
+
+def encode_player(player):
+    '''Encode a dict of a player's id and changed fields'''
+    mask = 0
+    values = []
+    for field in FIELDS:
+        if field in player:
+            mask |= FIELD_BITS[field]
+            FIELD_ENCODERS[field](values, player[field])
+    if 'username' not in player:
+        return mask_format(mask).pack(player['id'], mask, *values)
+    # the username length is the last packed value, followed by the text
+    username = values.pop()
+    return mask_format(mask).pack(player['id'], mask, *values, len(username)) + username
+
+
+# functions appending the packed values of each player field
+FIELD_ENCODERS = {'location': lambda values, value: values.extend(value),
+                  'role':     lambda values, value: values.append(value),
+                  'score':    lambda values, value: values.append(value),
+                  'inputs':   lambda values, value: values.append(value),
+                  'color':    lambda values, value: values.extend(value),
+                  'bgcolor':  lambda values, value: values.extend(value),
+                  'username': lambda values, value: values.append(encode_text(value))}
+
+
+def decode(data):
+    '''Decode a datagram into a message dict
+
+    raises ProtocolError for anything that is not a valid message of this version'''
+    try:
+        version, code = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise ProtocolError('unsupported protocol version: %d' % version)
+        if code not in TYPE_NAMES:
+            raise ProtocolError('unknown message type: %d' % code)
+        kind = TYPE_NAMES[code]
+        offset = HEADER.size
+
+        if kind == 'login':
+            timestamp, length = LOGIN_FORMAT.unpack_from(data, offset)
+            offset += LOGIN_FORMAT.size
+            return {'type': kind, 'timestamp': timestamp, 'username': decode_text(data, offset, length)}
+        if kind == 'login_ack':
+            status, player_id = LOGIN_ACK_FORMAT.unpack_from(data, offset)
+            return {'type': kind, 'status': STATUSES[status], 'id': player_id}
+        if kind == 'inputs':
+            mask, seq, timestamp = INPUTS_FORMAT.unpack_from(data, offset)
+            return {'type': kind, 'inputs': mask, 'seq': seq, 'timestamp': timestamp}
+        if kind == 'update_ack':
+            ack, timestamp = UPDATE_ACK_FORMAT.unpack_from(data, offset)
+            return {'type': kind, 'ack': ack, 'timestamp': timestamp}
+        if kind == 'update':
+            state, baseline, map_seed, next_map_seed, timestamp, ack_seq, ack_ticks = UPDATE_FORMAT.unpack_from(data, offset)
+            offset += UPDATE_FORMAT.size
+            players, offset = decode_players(data, offset)
+            local, offset = decode_players(data, offset)
+            removed, offset = decode_ids(data, offset)
+            hidden, offset = decode_ids(data, offset)
+            return {'type': kind, 'baseline': baseline, 'players': players, 'local': local,
+                    'removed': removed, 'hidden': hidden, 'game_state': STATES[state],
+                    'map_seed': map_seed, 'next_map_seed': next_map_seed, 'timestamp': timestamp,
+                    'ack_seq': ack_seq, 'ack_ticks': ack_ticks}
+        if kind == 'fragment':
+            message_id, index, count = FRAGMENT_FORMAT.unpack_from(data, offset)
+            if index >= count:
+                raise ProtocolError('bad fragment index')
+            return {'type': kind, 'message_id': message_id, 'index': index, 'count': count,
+                    'data': bytes(data[offset+FRAGMENT_FORMAT.size:])}
+        if kind == 'redirect':
+            port, = REDIRECT_FORMAT.unpack_from(data, offset)
+            return {'type': kind, 'port': port}
+        return {'type': kind}
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ProtocolError('malformed datagram: %s' % e)
+
+
+def decode_players(data, offset):
+    '''Decode a section of player changes, returns the list and the next offset'''
+    count, = COUNT_FORMAT.unpack_from(data, offset)
+    offset += COUNT_FORMAT.size
+    players = []
+    for _ in range(count):
+        player, offset = decode_player(data, offset)
+        players.append(player)
+    return players, offset
+
+
+def decode_ids(data, offset):
+    '''Decode a section of player ids, returns the list and the next offset'''
+    count, = COUNT_FORMAT.unpack_from(data, offset)
+    offset += COUNT_FORMAT.size
+    ids = [ID_FORMAT.unpack_from(data, offset + i*ID_FORMAT.size)[0] for i in range(count)]
+    return ids, offset + count*ID_FORMAT.size
+
+
+def decode_player(data, offset):
+    '''Decode one player's id and changed fields, returns the dict and the next offset'''
+    player_id, mask = PLAYER_FORMAT.unpack_from(data, offset)
+    packed = mask_format(mask)
+    values = packed.unpack_from(data, offset)
+    offset += packed.size
+    player = {'id': player_id}
+    i = 2
+    for field in FIELDS:
+        if mask & FIELD_BITS[field]:
+            count = FIELD_COUNTS[field]
+            player[field] = FIELD_DECODERS[field](values[i:i+count])
+            i += count
+    if 'username' in player:
+        length = player['username']
+        player['username'] = decode_text(data, offset, length)
+        offset += length
+    return player, offset
+
+
+# the number of packed values in each player field
+FIELD_COUNTS = {'location': 2, 'role': 1, 'score': 1, 'inputs': 1, 'color': 3, 'bgcolor': 3, 'username': 1}
+
+def decode_role(values):
+    '''Check that a packed role is one of the *_ROLE ints'''
+    if values[0] >= len(ROLE_NAMES):
+        raise ProtocolError('unknown role: %d' % values[0])
+    return values[0]
+
+
+# functions converting the packed values of each player field
+FIELD_DECODERS = {'location': list,
+                  'role':     decode_role,
+                  'score':    lambda values: values[0],
+                  'inputs':   lambda values: values[0],
+                  'color':    tuple,
+                  'bgcolor':  tuple,
+                  'username': lambda values: values[0]}
+
+
+def decode_text(data, offset, length):
+    '''Decode a utf-8 string of length bytes, checking that it is all there'''
+    if offset + length > len(data):
+        raise ProtocolError('truncated string')
+    return bytes(data[offset:offset+length]).decode('utf-8')
+
+
+class Reassembler:
+    '''Puts fragmented datagrams back together
+
+    Keeps at most FRAGMENT_BUFFER partly received messages, dropping the
+    oldest when a new one starts, so a lost fragment can't leak memory.'''
+    def __init__(self, size=FRAGMENT_BUFFER):
+        self.size = size
+        # message id -> list of the fragments received so far
+        self.partial = OrderedDict()
+
+    def add(self, message):
+        '''Add a decoded fragment, returns the whole datagram once every fragment has arrived'''
+        chunks = self.partial.get(message['message_id'])
+        if chunks is None or len(chunks) != message['count']:
+            chunks = self.partial[message['message_id']] = [None] * message['count']
+            while len(self.partial) > self.size:
+                self.partial.popitem(last=False)
+        chunks[message['index']] = message['data']
+        if any(chunk is None for chunk in chunks):
+            return None
+        del self.partial[message['message_id']]
+        return b''.join(chunks)
@@ -0,0 +1,55 @@
+class Rect:
+    '''An integer rectangle with the parts of pygame.Rect the simulation uses
+
+    So the server can check catches without importing pygame. Like
+    pygame.Rect the position is whole pixels, and colliderect doesn't count
+    rects that only touch at an edge.'''
+    __slots__ = ('x', 'y', 'w', 'h')
+
+    def __init__(self, x, y, w, h):
+        self.x = x
+        self.y = y
+        self.w = w
+        self.h = h
+
+    def __repr__(self):
+        return '<rect(%d, %d, %d, %d)>' % (self.x, self.y, self.w, self.h)
+
+    def __eq__(self, other):
+        return (self.x, self.y, self.w, self.h) == tuple(other)
+
+    def __iter__(self):
+        return iter((self.x, self.y, self.w, self.h))
+
+    @property
+    def left(self):
+        return self.x
+
+    @property
+    def top(self):
+        return self.y
+
+    @property
+    def right(self):
+        return self.x + self.w
+
+    @property
+    def bottom(self):
+        return self.y + self.h
+
+    @property
+    def width(self):
+        return self.w
+
+    @property
+    def height(self):
+        return self.h
+
+    @property
+    def center(self):
+        return (self.x + self.w // 2, self.y + self.h // 2)
+
+    def colliderect(self, other):
+        '''Check if two rects overlap'''
+        return (self.x < other.x + other.w and other.x < self.x + self.w and
+                self.y < other.y + other.h and other.y < self.y + self.h)
@@ -0,0 +1,95 @@
+import heapq
+import threading
+import time
+from collections import deque
+
+from config import *
+
+
+class PlayerRegistry:
+    '''The server's players, indexed by address, username and id
+
+    Players get the smallest free integer id when they are added, so ids stay
+    small enough to send as 16 bit integers. A removed player's id is only
+    given out again reuse_delay seconds later, so the lag compensation
+    history and the clients' interpolation, which are keyed by id, are done
+    with the old player before a new one takes the id. Lookups are dict
+    accesses, and adding or removing a player is guarded by a lock so the
+    serve, notify and main loop threads can all use the registry at once. Iterating goes over
+    an immutable snapshot of the players, so it is safe while other threads
+    add or remove players.'''
+    def __init__(self, max_players=2**16, reuse_delay=ID_REUSE_DELAY, clock=time.monotonic):
+        self.max_players = max_players
+        self.reuse_delay = reuse_delay
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.by_address = {}
+        self.by_username = {}
+        self.by_id = {}
+        # ids released by removed players, reused smallest first
+        self.free_ids = []
+        # (release time, id) of the ids that can't be reused yet, oldest first
+        self.released_ids = deque()
+        self.next_id = 0
+        # tuple of the players, rebuilt on the first iteration after a change
+        self.snapshot = ()
+
+    def __iter__(self):
+        snapshot = self.snapshot
+        if snapshot is None:
+            with self.lock:
+                snapshot = self.snapshot = tuple(self.by_id.values())
+        return iter(snapshot)
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def __contains__(self, player):
+        return self.by_id.get(player.id) is player
+
+    def add(self, player):
+        '''Register a player and give it an id
+
+        returns False without registering the player if its username or address
+        is already taken or there are no free ids left'''
+        with self.lock:
+            if player.username in self.by_username or player.address in self.by_address:
+                return False
+            now = self.clock()
+            while self.released_ids and now - self.released_ids[0][0] >= self.reuse_delay:
+                heapq.heappush(self.free_ids, self.released_ids.popleft()[1])
+            if self.free_ids:
+                player.id = heapq.heappop(self.free_ids)
+            elif self.next_id < self.max_players:
+                player.id = self.next_id
+                self.next_id += 1
+            else:
+                return False
+            self.by_address[player.address] = player
+            self.by_username[player.username] = player
+            self.by_id[player.id] = player
+            self.snapshot = None
+            return True
+
+    def remove(self, player):
+        '''Unregister a player and release its id, to be reused after reuse_delay'''
+        with self.lock:
+            if self.by_id.get(player.id) is not player:
+                return
+            del self.by_address[player.address]
+            del self.by_username[player.username]
+            del self.by_id[player.id]
+            self.released_ids.append((self.clock(), player.id))
+            self.snapshot = None
+
+    def get(self, player_id):
+        '''Get the player with an id, or None'''
+        return self.by_id.get(player_id)
+
+    def get_by_address(self, address):
+        '''Get the player logged in from an address, or None'''
+        return self.by_address.get(address)
+
+    def get_by_username(self, username):
+        '''Get the player with a username, or None'''
+        return self.by_username.get(username)
@@ -0,0 +1,49 @@
+import numpy as np
+
+from config import *
+
+
+class PositionHistory:
+    '''The positions of every player over the last few ticks, for lag compensation
+
+    A ring of ticks rows, each an array of positions indexed by player id,
+    so recording a tick is one array assignment and the memory per player
+    stays the same however long the server runs. The arrays grow when a
+    player gets an id past the end.'''
+    def __init__(self, ticks=MAX_REWIND_TICKS + 1, capacity=64):
+        self.size = ticks
+        # the tick stored in each row, -1 for rows not written yet
+        self.ticks = np.full(ticks, -1, dtype=np.int64)
+        self.positions = np.full((ticks, capacity, 2), np.nan)
+
+    def record(self, tick, players):
+        '''Store the positions of the players at a tick, overwriting the oldest tick'''
+        players = list(players)
+        ids = np.fromiter((player.id for player in players), dtype=np.intp, count=len(players))
+        if len(ids) and ids.max() >= self.positions.shape[1]:
+            self.grow(ids.max() + 1)
+        row = tick % self.size
+        self.ticks[row] = tick
+        self.positions[row] = np.nan
+        if len(ids):
+            self.positions[row, ids] = [player.location for player in players]
+
+    def grow(self, capacity):
+        '''Make room for ids below capacity, at least doubling the arrays'''
+        capacity = max(capacity, 2 * self.positions.shape[1])
+        positions = np.full((self.size, capacity, 2), np.nan)
+        positions[:, :self.positions.shape[1]] = self.positions
+        self.positions = positions
+
+    def get(self, tick, ids):
+        '''Get the positions of some players at a tick
+
+        players that weren't there, or ticks that are no longer kept, are nan'''
+        ids = np.asarray(ids, dtype=np.intp)
+        row = tick % self.size
+        if tick < 0 or self.ticks[row] != tick:
+            return np.full((len(ids), 2), np.nan)
+        positions = np.full((len(ids), 2), np.nan)
+        known = ids < self.positions.shape[1]
+        positions[known] = self.positions[row, ids[known]]
+        return positions
@@ -1,5 +1,49 @@
-from headlessgameserver import HeadlessGameServer
+import argparse
+import logging
 
-server = HeadlessGameServer()
-server.setup_server()
-server.main_loop()
\ No newline at end of file
+from config import SERVER_ENGINE, ROOM_COUNT, ROOM_CAPACITY, ROOM_WORKERS, STATS_ADDRESS, STATS_FILE, LOG_LEVEL, GAME_MODE
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the hide-and-seek game server')
+    parser.add_argument('--engine', choices=['threaded', 'asyncio'], default=SERVER_ENGINE,
+                        help='run the server on threads or on an asyncio event loop')
+    parser.add_argument('--lobby', action='store_true',
+                        help='run a lobby sending players to many rooms in worker processes')
+    parser.add_argument('--rooms', type=int, default=ROOM_COUNT, help='number of rooms the lobby runs')
+    parser.add_argument('--capacity', type=int, default=ROOM_CAPACITY, help='most players in a room')
+    parser.add_argument('--workers', type=int, default=ROOM_WORKERS, help='worker processes for the rooms')
+    parser.add_argument('--mode', choices=['classic', 'seekers', 'infection'], default=GAME_MODE,
+                        help='one seeker, SEEKER_COUNT seekers, or caught hiders become seekers')
+    parser.add_argument('--stats-port', type=int, help='serve json stats at http://127.0.0.1:PORT/')
+    parser.add_argument('--stats-file', default=STATS_FILE, help='append a json line of stats to this file every STATS_INTERVAL seconds')
+    parser.add_argument('--log-level', default=LOG_LEVEL, choices=['debug', 'info', 'warning', 'error'])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    stats_address = ('127.0.0.1', args.stats_port) if args.stats_port else STATS_ADDRESS
+
+    if args.lobby:
+        from lobby import Lobby
+
+        lobby = Lobby(args.rooms, args.capacity, args.workers, args.mode)
+        lobby.setup_server()
+        lobby.serve_forever()
+    elif args.engine == 'asyncio':
+        from asyncserver import AsyncGameServer
+
+        server = AsyncGameServer()
+        server.stats_address, server.stats_file = stats_address, args.stats_file
+        server.mode = args.mode
+        server.run()
+    else:
+        from headlessgameserver import HeadlessGameServer
+
+        server = HeadlessGameServer()
+        server.stats_address, server.stats_file = stats_address, args.stats_file
+        server.mode = args.mode
+        server.setup_server()
+        server.main_loop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+'''Game state snapshots and the deltas between them
+
+A snapshot maps each player id to a dict of that player's fields as they
+are sent in an update. The server keeps a short history of the snapshots
+it sent and encodes each client's update as a delta against the last one
+that client acknowledged. The client keeps the snapshots it rebuilt so it
+can apply the next delta on top of the same baseline.
+
+Updates are split in two parts: the scoreboard fields of every player,
+which are the same for all clients, and the position fields, which are
+only sent for the players in a client's area of interest.
+'''
+from collections import OrderedDict
+
+from config import *
+
+# the player fields sent in updates, in wire order
+FIELDS = ('location', 'role', 'score', 'inputs', 'color', 'bgcolor', 'username')
+# fields sent for every player, and fields only sent for players in view
+SCOREBOARD_FIELDS = ('role', 'score', 'color', 'bgcolor', 'username')
+POSITION_FIELDS = ('location', 'inputs')
+
+# functions reading the snapshot value of each field from a player
+FIELD_GETTERS = {'location': lambda player: (player.location[0], player.location[1]),
+                 'role':     lambda player: player.role,
+                 'score':    lambda player: player.score,
+                 'inputs':   lambda player: player.inputs,
+                 'color':    lambda player: tuple(player.color),
+                 'bgcolor':  lambda player: tuple(player.bgcolor),
+                 'username': lambda player: player.username}
+
+
+def take_snapshot(players, fields=FIELDS):
+    '''Build a snapshot of the given fields for every player'''
+    getters = [(field, FIELD_GETTERS[field]) for field in fields]
+    return {player.id: {field: get(player) for field, get in getters} for player in players}
+
+
+def delta(baseline, snapshot):
+    '''Get the changes from a baseline snapshot to a newer one
+
+    Returns (players, removed): a list of dicts holding the id and only the
+    fields that changed for each player, and the ids of the players that are
+    gone. Players with no changes are left out entirely.'''
+    players = []
+    for player_id, fields in snapshot.items():
+        old = baseline.get(player_id)
+        if old is None:
+            changed = dict(fields)
+        else:
+            changed = {key: value for key, value in fields.items() if old[key] != value}
+            if not changed:
+                continue
+        changed['id'] = player_id
+        players.append(changed)
+    removed = [player_id for player_id in baseline if player_id not in snapshot]
+    return players, removed
+
+
+def apply_delta(baseline, players, removed, hidden=()):
+    '''Rebuild a full snapshot from a baseline and the changes of an update
+
+    players that left the area of interest (hidden) lose their position fields'''
+    removed = set(removed)
+    snapshot = {player_id: fields for player_id, fields in baseline.items() if player_id not in removed}
+    for player_id in hidden:
+        if player_id in snapshot:
+            snapshot[player_id] = {key: value for key, value in snapshot[player_id].items() if key not in POSITION_FIELDS}
+    for changed in players:
+        fields = dict(snapshot.get(changed['id'], {}))
+        fields.update((key, value) for key, value in changed.items() if key != 'id')
+        snapshot[changed['id']] = fields
+    return snapshot
+
+
+class SnapshotHistory:
+    '''A bounded ring of recent snapshots keyed by update timestamp'''
+    def __init__(self, size=SNAPSHOT_HISTORY):
+        self.size = size
+        self.snapshots = OrderedDict()
+
+    def add(self, timestamp, snapshot):
+        '''Store a snapshot, dropping the oldest one if the ring is full'''
+        self.snapshots[timestamp] = snapshot
+        self.snapshots.move_to_end(timestamp)
+        while len(self.snapshots) > self.size:
+            self.snapshots.popitem(last=False)
+
+    def get(self, timestamp):
+        '''Get the snapshot for a timestamp, or None if it is not in the ring'''
+        return self.snapshots.get(timestamp)
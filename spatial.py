@@ -0,0 +1,74 @@
+from config import *
+
+
+class SpatialHash:
+    '''Keys bucketed into square cells by position, for finding what is near a point
+
+    It is kept up to date incrementally: sync() only moves the keys whose
+    position crossed into another cell since the last sync, so syncing every
+    tick is cheap when most players stay in their cell. A query only looks
+    at the keys in the cells its rectangle overlaps, so its cost depends on
+    how crowded that spot is rather than on the number of keys.'''
+    def __init__(self, cell_size=CATCH_CELL_SIZE):
+        self.cell_size = cell_size
+        # cell -> set of keys, and key -> the cell it is in
+        self.cells = {}
+        self.where = {}
+
+    def __len__(self):
+        return len(self.where)
+
+    def cell(self, x, y):
+        '''Get the cell a position is in'''
+        return (int(x // self.cell_size), int(y // self.cell_size))
+
+    def put(self, key, cell):
+        '''Put a key in a cell, taking it out of its old one'''
+        old = self.where.get(key)
+        if old is not None:
+            self.discard(key, old)
+        self.where[key] = cell
+        keys = self.cells.get(cell)
+        if keys is None:
+            self.cells[cell] = {key}
+        else:
+            keys.add(key)
+
+    def discard(self, key, cell):
+        '''Take a key out of a cell, dropping the cell when it is empty'''
+        keys = self.cells[cell]
+        keys.discard(key)
+        if not keys:
+            del self.cells[cell]
+
+    def remove(self, key):
+        '''Take a key out of the hash, if it is in it'''
+        cell = self.where.pop(key, None)
+        if cell is not None:
+            self.discard(key, cell)
+
+    def sync(self, items):
+        '''Move every (key, x, y) in a list of items and remove the keys that aren't in it any more'''
+        # cell() inlined and put() only called for keys that changed cell, as this runs for every player every tick
+        size = self.cell_size
+        where = self.where
+        for key, x, y in items:
+            cell = (int(x // size), int(y // size))
+            if where.get(key) != cell:
+                self.put(key, cell)
+        # every key in items is in the hash now, any more are gone
+        if len(items) != len(where):
+            for key in where.keys() - {item[0] for item in items}:
+                self.remove(key)
+
+    def query(self, x1, y1, x2, y2):
+        '''Get the keys in the cells overlapping a rectangle, they may be a little outside it'''
+        cx1, cy1 = self.cell(min(x1, x2), min(y1, y2))
+        cx2, cy2 = self.cell(max(x1, x2), max(y1, y2))
+        found = []
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                keys = self.cells.get((cx, cy))
+                if keys:
+                    found.extend(keys)
+        return found
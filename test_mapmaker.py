@@ -0,0 +1,81 @@
+# run with: python -m pytest
+import random
+
+import numpy as np
+import pytest
+
+from collision import Walls
+from mapmaker import Maze
+from config import *
+
+SEEDS = (1, 2, 3, 7, 42)
+SPEEDS = (HIDER_SPEED, SEEKER_SPEED, GHOST_SPEED)
+DIRECTIONS = [(1,0),(-1,0),(0,1),(0,-1),(1,1),(-1,1),(1,-1),(-1,-1)]
+
+
+def make_maze(seed, size=20):
+    maze = Maze(size, size, size//2, size//2)
+    maze.make_maze(seed)
+    return maze
+
+
+def random_steps(count, size, seed):
+    '''Steps in every direction from random spots on and around the map'''
+    myrandom = random.Random(seed)
+    steps = []
+    for _ in range(count):
+        x = myrandom.uniform(-2*CELL_SIZE, size*CELL_SIZE)
+        y = myrandom.uniform(-2*CELL_SIZE, size*CELL_SIZE)
+        dx, dy = myrandom.choice(DIRECTIONS)
+        speed = myrandom.choice(SPEEDS)
+        steps.append([x, y, x + dx*speed, y + dy*speed])
+    return np.array(steps)
+
+
+def joint_steps(size):
+    '''Steps starting on, ending on and passing through the cell corners, where merged walls join
+
+    offsets of 0 put the start on a wall line, and offsets of -speed end the step on one'''
+    steps = []
+    corners = np.arange(-1, size) * CELL_SIZE
+    for speed in SPEEDS:
+        offsets = (0, 1, -1, speed//2, -speed//2, speed, -speed)
+        for cx in corners:
+            for cy in corners:
+                for ox in offsets:
+                    for oy in offsets:
+                        for dx, dy in DIRECTIONS:
+                            x, y = cx + ox, cy + oy
+                            steps.append([x, y, x + dx*speed, y + dy*speed])
+    return np.array(steps)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_merged_walls_block_random_steps(seed):
+    maze = make_maze(seed)
+    original = Walls(maze.get_wall_list(merge=False))
+    merged = Walls(maze.get_wall_list())
+    steps = random_steps(20000, maze.nx, seed)
+    assert (original.collide_many(steps) == merged.collide_many(steps)).all()
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_merged_walls_block_steps_at_joints(seed):
+    maze = make_maze(seed, size=12)
+    original = Walls(maze.get_wall_list(merge=False))
+    merged = Walls(maze.get_wall_list())
+    steps = joint_steps(maze.nx)
+    blocked = original.collide_many(steps)
+    # the joints have to actually be hit for this to say anything
+    assert blocked.any() and not blocked.all()
+    assert (blocked == merged.collide_many(steps)).all()
+
+
+def test_merging_joins_walls():
+    maze = make_maze(1)
+    original = maze.get_wall_list(merge=False)
+    merged = maze.get_wall_list()
+    assert len(merged) < len(original)
+    # every merged wall is horizontal or vertical on the cell lattice
+    assert ((merged[:,0] == merged[:,2]) | (merged[:,1] == merged[:,3])).all()
+    assert (merged % CELL_SIZE == 0).all()
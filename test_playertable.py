@@ -0,0 +1,66 @@
+# run with: python -m pytest
+import random
+
+import pytest
+
+from game import Game
+from player import PlayerState
+from config import *
+
+
+def make_players(count, seed):
+    '''Ghosts, hiders and seekers spread over the map, with their role's speed'''
+    myrandom = random.Random(seed)
+    players = []
+    for i in range(count):
+        player = PlayerState([myrandom.uniform(0, MAP_SIZE*CELL_SIZE), myrandom.uniform(0, MAP_SIZE*CELL_SIZE)], 'player%d' % i)
+        player.id = i
+        player.role = myrandom.choice([GHOST_ROLE, HIDER_ROLE, HIDER_ROLE, SEEKER_ROLE])
+        player.speed = ROLE_SPEEDS[player.role]
+        players.append(player)
+    return players
+
+
+def copy_players(players):
+    copies = []
+    for player in players:
+        copy = PlayerState(list(player.location), player.username)
+        copy.id, copy.role, copy.speed = player.id, player.role, player.speed
+        copies.append(copy)
+    return copies
+
+
+@pytest.mark.parametrize('state', ['hiding', 'seeking'])
+@pytest.mark.parametrize('seed', [1, 2])
+def test_batched_step_matches_objects(state, seed):
+    '''update_batched moves every player to exactly where update_objects does'''
+    batched, objects = Game(), Game()
+    batched.map = objects.map = batched.generate_map(seed)
+    batched.state = objects.state = state
+    batched.players = make_players(300, seed)
+    objects.players = copy_players(batched.players)
+
+    myrandom = random.Random(seed)
+    blocked = frozen = ghosted = 0
+    for tick in range(200):
+        # everyone changes keys now and then, sometimes two at once or none
+        for a, b in zip(batched.players, objects.players):
+            if myrandom.random() < 0.1:
+                a.inputs = b.inputs = sum(1 << key for key in myrandom.sample(ARROW_KEYS, myrandom.choice([0, 1, 1, 2])))
+        before = [list(player.location) for player in objects.players]
+        batched.update_batched()
+        objects.update_objects()
+
+        for a, b, start in zip(batched.players, objects.players, before):
+            assert a.location == b.location, (tick, a.username)
+            if b.inputs and b.location == start:
+                if b.role == SEEKER_ROLE and state == 'hiding':
+                    frozen += 1
+                elif b.get_step() != (0, 0):
+                    blocked += 1
+            if b.role == GHOST_ROLE and b.inputs:
+                ghosted += objects.map.collide(start + b.location)
+
+    # the cases the two paths handle separately all came up
+    assert blocked and ghosted
+    assert frozen if state == 'hiding' else not frozen
@@ -0,0 +1,83 @@
+# run with: python -m pytest
+import random
+
+import pytest
+
+import protocol
+from config import *
+
+
+def payload(size, seed=0):
+    return random.Random(seed).randbytes(size)
+
+
+def fragments(data, message_id, mtu=MTU):
+    '''Fragment a datagram and decode the pieces like the client does'''
+    return [protocol.decode(datagram) for datagram in protocol.fragment(data, message_id, mtu)]
+
+
+def test_small_datagram_is_not_fragmented():
+    data = payload(MTU)
+    assert protocol.fragment(data, 1) == [data]
+
+
+def test_fragments_fit_the_mtu():
+    datagrams = protocol.fragment(payload(5000), 1)
+    assert len(datagrams) > 1
+    assert all(len(datagram) <= MTU for datagram in datagrams)
+
+
+def test_out_of_order_fragments():
+    data = payload(5000)
+    pieces = fragments(data, 7)
+    random.Random(1).shuffle(pieces)
+    reassembler = protocol.Reassembler()
+    results = [reassembler.add(piece) for piece in pieces]
+    # only the last fragment to arrive completes the datagram
+    assert results[:-1] == [None] * (len(pieces) - 1)
+    assert results[-1] == data
+    assert not reassembler.partial
+
+
+def test_duplicate_fragment():
+    data = payload(5000)
+    pieces = fragments(data, 7)
+    reassembler = protocol.Reassembler()
+    assert reassembler.add(pieces[0]) is None
+    assert reassembler.add(pieces[0]) is None
+    for piece in pieces[1:-1]:
+        assert reassembler.add(piece) is None
+    assert reassembler.add(pieces[-1]) == data
+    # a copy arriving after the datagram was put together starts over instead of repeating it
+    assert reassembler.add(pieces[0]) is None
+
+
+def test_lost_fragment_is_dropped_for_the_next_message():
+    first, second = payload(5000, 1), payload(5000, 2)
+    reassembler = protocol.Reassembler(size=1)
+    lost = fragments(first, 1)
+    for piece in lost[:-1]:
+        assert reassembler.add(piece) is None
+    # the next message pushes out the one missing a fragment
+    pieces = fragments(second, 2)
+    for piece in pieces[:-1]:
+        assert reassembler.add(piece) is None
+    assert list(reassembler.partial) == [2]
+    assert reassembler.add(pieces[-1]) == second
+    # the missing fragment turning up late doesn't bring back the dropped message
+    assert reassembler.add(lost[-1]) is None
+
+
+def test_partial_messages_are_bounded():
+    reassembler = protocol.Reassembler()
+    for message_id in range(FRAGMENT_BUFFER * 3):
+        assert reassembler.add(fragments(payload(3000, message_id), message_id)[0]) is None
+    assert len(reassembler.partial) == FRAGMENT_BUFFER
+    assert list(reassembler.partial) == list(range(FRAGMENT_BUFFER * 2, FRAGMENT_BUFFER * 3))
+
+
+def test_too_many_fragments():
+    chunk = MTU - protocol.HEADER.size - protocol.FRAGMENT_FORMAT.size
+    assert len(protocol.fragment(payload(255 * chunk), 1)) == 255
+    with pytest.raises(protocol.ProtocolError):
+        protocol.fragment(payload(255 * chunk + 1), 1)
@@ -0,0 +1,119 @@
+# run with: python -m pytest
+import protocol
+from headlessgameserver import HeadlessGameServer, ConnectedPlayer
+from player import PlayerState
+from snapshots import take_snapshot, delta, apply_delta, SnapshotHistory, SCOREBOARD_FIELDS, POSITION_FIELDS
+from config import *
+
+
+def make_players(count):
+    players = []
+    for i in range(count):
+        player = PlayerState([100.0 * i, 50.0], 'player%d' % i)
+        player.id = i
+        player.role = HIDER_ROLE
+        players.append(player)
+    return players
+
+
+def test_delta_round_trip():
+    players = make_players(5)
+    baseline = take_snapshot(players)
+
+    players[0].location = [5.0, 6.0]
+    players[1].score += 2
+    players[2].role = GHOST_ROLE
+    # player 3 leaves and a new player joins, player 4 doesn't change
+    gone = players.pop(3)
+    newcomer = PlayerState([1.0, 2.0], 'newcomer')
+    newcomer.id = 9
+    players.append(newcomer)
+    snapshot = take_snapshot(players)
+
+    changed, removed = delta(baseline, snapshot)
+    assert removed == [gone.id]
+    by_id = {fields['id']: fields for fields in changed}
+    # only what changed is sent, and unchanged players not at all
+    assert by_id[0] == {'id': 0, 'location': (5.0, 6.0)}
+    assert by_id[1] == {'id': 1, 'score': 2}
+    assert by_id[2] == {'id': 2, 'role': GHOST_ROLE}
+    assert 4 not in by_id
+    assert by_id[9] == dict(snapshot[9], id=9)
+    assert apply_delta(baseline, changed, removed) == snapshot
+
+
+def test_delta_against_nothing_is_full_snapshot():
+    snapshot = take_snapshot(make_players(3))
+    changed, removed = delta({}, snapshot)
+    assert removed == []
+    assert apply_delta({}, changed, removed) == snapshot
+
+
+def test_hidden_players_lose_their_position():
+    players = make_players(2)
+    baseline = take_snapshot(players)
+    snapshot = apply_delta(baseline, [], [], hidden=[1])
+    assert snapshot[0] == baseline[0]
+    assert not set(POSITION_FIELDS) & set(snapshot[1])
+    assert snapshot[1]['username'] == 'player1'
+
+
+def test_history_evicts_oldest():
+    history = SnapshotHistory(size=3)
+    for timestamp in range(5):
+        history.add(timestamp, {'t': timestamp})
+    assert history.get(0) is None and history.get(1) is None
+    assert [history.get(t) for t in (2, 3, 4)] == [{'t': 2}, {'t': 3}, {'t': 4}]
+
+
+class RecordingSocket:
+    '''Stands in for the server socket, keeping the datagrams sent'''
+    def __init__(self):
+        self.sent = []
+
+    def sendto(self, data, address):
+        self.sent.append((data, address))
+
+    def close(self):
+        pass
+
+
+def send_update(server, timestamp):
+    '''Broadcast one update and decode what the first client got'''
+    server.socket.sent = []
+    list(server.iter_updates(timestamp))
+    first = server.players.get(0).address
+    [data] = [data for data, address in server.socket.sent if address == first]
+    return protocol.decode(data)
+
+
+def test_server_falls_back_to_full_snapshot():
+    server = HeadlessGameServer()
+    server.socket.close()
+    server.socket = RecordingSocket()
+    for i in range(3):
+        player = ConnectedPlayer([MAP_CENTER[0] + 10*i, MAP_CENTER[1]], 'player%d' % i, ('127.0.0.1', 20000 + i))
+        server.players.add(player)
+    client = server.players.get(0)
+
+    # nothing acknowledged yet, so the first update is a full snapshot
+    message = send_update(server, 1)
+    assert message['baseline'] == -1
+    full = apply_delta({}, message['players'], message['removed'])
+    assert full == take_snapshot(server.players, SCOREBOARD_FIELDS)
+
+    # against an acknowledged update only the changes are sent
+    client.acked_timestamp = 1
+    server.players.get(1).score = 5
+    message = send_update(server, 2)
+    assert message['baseline'] == 1
+    assert message['players'] == [{'id': 1, 'score': 5}]
+    assert apply_delta(full, message['players'], message['removed']) == take_snapshot(server.players, SCOREBOARD_FIELDS)
+
+    # once the acknowledged update is evicted from the history it is a full snapshot again
+    for timestamp in range(3, 3 + SNAPSHOT_HISTORY):
+        send_update(server, timestamp)
+    assert server.history.get(1) is None
+    message = send_update(server, 100)
+    assert message['baseline'] == -1
+    assert apply_delta({}, message['players'], message['removed']) == take_snapshot(server.players, SCOREBOARD_FIELDS)
@@ -0,0 +1,29 @@
+from collections import OrderedDict
+
+from config import *
+
+
+class TextCache:
+    '''A bounded LRU cache of rendered text surfaces keyed by (text, color)
+
+    Names, scores and the game state hardly ever change between frames, so
+    each is rendered by the font once and blitted from the cache after. A
+    changed score is just a new key, the old one drops out when the cache
+    is full.'''
+    def __init__(self, font, size=TEXT_CACHE_SIZE):
+        self.font = font
+        self.size = size
+        # (text, color) -> surface, least recently used first
+        self.surfaces = OrderedDict()
+
+    def render(self, text, color):
+        '''Get the antialiased surface of text in color, like font.render'''
+        key = (text, color)
+        surface = self.surfaces.get(key)
+        if surface is not None:
+            self.surfaces.move_to_end(key)
+            return surface
+        surface = self.surfaces[key] = self.font.render(text, True, color)
+        while len(self.surfaces) > self.size:
+            self.surfaces.popitem(last=False)
+        return surface
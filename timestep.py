@@ -0,0 +1,73 @@
+import time
+from collections import deque
+
+from config import *
+
+
+class FixedTimestep:
+    '''Runs a simulation step at a fixed rate, numbering the ticks
+
+    Every tick stands for exactly 1/rate seconds of game time, so the game
+    runs at the same speed however long the ticks take. When the loop falls
+    behind it runs the missed ticks back to back to catch up, but never more
+    than max_catch_up at once; anything further behind is skipped so an
+    overloaded server doesn't spiral.
+
+    Keeps counters of what the ticks cost: overruns counts ticks that took
+    longer than their 1/rate budget and skipped counts ticks dropped to
+    catch up.'''
+    def __init__(self, rate=TICK_RATE, max_catch_up=MAX_CATCH_UP, clock=time.perf_counter):
+        self.rate = rate
+        self.dt = 1 / rate
+        self.max_catch_up = max_catch_up
+        self.clock = clock
+        # the number of the next tick to run
+        self.tick = 0
+        # clock time the tick numbers count from
+        self.start = None
+        self.overruns = 0
+        self.skipped = 0
+        # seconds taken by the last second worth of ticks
+        self.costs = deque(maxlen=rate)
+        self.max_cost = 0
+
+    def run(self, step):
+        '''Run step(tick) for every tick that is due, returns the seconds until the next one'''
+        now = self.clock()
+        if self.start is None:
+            self.start = now
+        due = int((now - self.start) * self.rate) + 1 - self.tick
+        if due > self.max_catch_up:
+            # too far behind, give up on the oldest ticks
+            self.skipped += due - self.max_catch_up
+            self.tick += due - self.max_catch_up
+            due = self.max_catch_up
+        for _ in range(due):
+            begin = self.clock()
+            step(self.tick)
+            cost = self.clock() - begin
+            self.costs.append(cost)
+            self.max_cost = max(self.max_cost, cost)
+            if cost > self.dt:
+                self.overruns += 1
+            self.tick += 1
+        return self.until_next()
+
+    def until_next(self):
+        '''Get the seconds until the next tick is due'''
+        return max(0, self.start + self.tick * self.dt - self.clock())
+
+    def load(self):
+        '''Get the fraction of the cpu budget the recent ticks used'''
+        if not self.costs:
+            return 0
+        return sum(self.costs) / len(self.costs) / self.dt
+
+    def stats(self):
+        '''Get the tick counters as a dict'''
+        return {'tick':     self.tick,
+                'rate':     self.rate,
+                'load':     self.load(),
+                'max_cost': self.max_cost,
+                'overruns': self.overruns,
+                'skipped':  self.skipped}
@@ -1,17 +1,24 @@
 import os, sys
 import pygame 
-import pickle
 import socket 
 import threading
 import time
+from collections import deque
 
-
-import numpy as np
-
+import protocol
 from player import Player 
+from snapshots import SnapshotHistory, apply_delta
+from timestep import FixedTimestep
+from interpolation import InterpolationBuffer
+from maplayer import MapLayer
+from textcache import TextCache
 from game import Game
+from metrics import get_logger
 
 from config import *
+from clientkeys import *
+
+log = get_logger(__name__)
 
 class VisualGame(Game):
     '''A class for the client-side of the hide and seek game
@@ -36,12 +43,18 @@ class VisualGame(Game):
         self.screen.set_colorkey((0,0,0))
         # initialize the Font
         self.textfont = pygame.font.Font(None, 25)
+        # names and scores are rendered once and reused until they change
+        self.text = TextCache(self.textfont)
+        # the surface each frame is drawn to, and the walls of the current map drawn into tiles
+        self.surface = pygame.Surface(SCREEN_SIZE)
+        self.map_layer = None
 
         # create the player objects - self.player is THIS client player, self.players is a list of all players
         self.player = Player(MAP_CENTER, username)
         self.players = [self.player]
         
-        # initialize UDP connection
+        # initialize UDP connection, a lobby may redirect us to a room at another port
+        self.server_address = SERVER_ADDRESS
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         
         self.socket.bind(('',0)) # have the computer give me a random port
@@ -53,6 +66,25 @@ class VisualGame(Game):
 
         # current time_stamp will handle the 
         self.current_update_timestamp = 0
+        # rebuilt server snapshots, the baselines the server sends deltas against
+        self.history = SnapshotHistory()
+        self.reassembler = protocol.Reassembler()
+        # the latest snapshot holds the scoreboard fields of every player, even those out of view
+        self.scoreboard = {}
+
+        # the client predicts its own movement on the same fixed ticks as the server
+        self.timestep = FixedTimestep(self.fps)
+        # inputs are numbered so updates can say which ones the server has simulated
+        self.input_seq = 0
+        # the (seq, number of the tick with those inputs, inputs) of each predicted tick the server hasn't acknowledged yet
+        self.input_history = deque(maxlen=INPUT_HISTORY)
+        # the seq of the inputs predicted with and the number of ticks predicted with them
+        self.predicted_seq = 0
+        self.predicted_ticks = 0
+        # held while the simulation or a server update moves the players
+        self.lock = threading.Lock()
+        # the other players are drawn a little in the past, between the updates around that time
+        self.interpolation = InterpolationBuffer()
 
     def serve_forever(self):
         '''loop forever to handle incoming UDP packets'''
@@ -61,10 +93,24 @@ class VisualGame(Game):
             data, address = self.socket.recvfrom(MAX_PACKET)
             
             if data:
-                data = pickle.loads(data)
+                try:
+                    data = protocol.decode(data)
+                    # big updates arrive in fragments, wait until all of them are here
+                    if data['type'] == 'fragment':
+                        data = self.reassembler.add(data)
+                        if data is None:
+                            continue
+                        data = protocol.decode(data)
+                except protocol.ProtocolError:
+                    continue
 
                 # print('received data: %s' % data['type'])
 
+                # the lobby picked a room for us, log in there instead
+                if data['type'] == 'redirect':
+                    print('redirected to room at %s:%d' % (address[0], data['port']))
+                    self.server_address = (address[0], data['port'])
+                    self.login(self.player.username)
                 # if login fails, then quit. 
                 if data['type'] == 'login_ack':
                     print("successful login at address: %s:%d" % address)
@@ -72,6 +118,8 @@ class VisualGame(Game):
                         print("login failed")
                         self.done = True 
                         sys.exit(1)
+                    # updates refer to players by id
+                    self.player.id = data['id']
                 # server may kick any players for inactivity or for failing to login properly
                 if data['type'] == 'kick':
                     print('kicked from game...')
@@ -79,53 +127,122 @@ class VisualGame(Game):
                     sys.exit(0)
                 # apply game-state updates
                 if data['type'] == 'update' and data['timestamp'] > self.current_update_timestamp:
+
+                    # rebuild the full state from the delta, skipping it if we no longer have its baseline
+                    baseline = {} if data['baseline'] == -1 else self.history.get(data['baseline'])
+                    if baseline is None:
+                        continue
+                    snapshot = apply_delta(baseline, data['players'] + data['local'], data['removed'], data['hidden'])
+                    self.history.add(data['timestamp'], snapshot)
+                    # let the server know it can send the next update as a delta against this one
+                    self.send({'type':'update_ack','ack':data['timestamp']})
                     
-                    # save the current inputs, we don't want to change these based on server update. 
-                    current_inputs = self.player.inputs
+                    with self.lock:
+                        # save the current inputs, we don't want to change these based on server update. 
+                        current_inputs = self.player.inputs
 
-                    # get the players data from the server and get the client player in self.player
-                    self.players = data['players']
-                    self.player = next(x for x in data['players'] if x.username == self.player.username)
+                        # update the game state
+                        self.state = data['game_state']
+                        # keep track of when the latest server update was received
+                        self.current_update_timestamp = data['timestamp']
 
-                    # if a server update contains incorrect player inputs, resend the inputs
-                    if current_inputs != self.player.inputs:
-                        print('correcting inputs to: %s' % str(current_inputs))
-                        self.send({'type':'inputs','inputs':current_inputs})
-                    
-                    # set the player inputs back to what the player is actually pressing
-                    self.player.inputs = current_inputs
-
-                    # update the game state
-                    self.state = data['game_state']
-                    # keep track of when the latest server update was received
-                    self.current_update_timestamp = data['timestamp']
-
-                    # if the mapseed is different from the current seed, then calculate the new map.
-                    if data['map_seed'] != self.map_seed:
-                        # generate new map...
-                        print('generating new client map with seed: %d' % data['map_seed'])
-                        self.map = self.generate_map(data['map_seed'])
-                        # update seed variable
-                        self.map_seed = data['map_seed']
-
-                    # TODO: Add averaging or some other method to reduce other players jumpiness
-                    # now = dict()
-                    # for p in self.players:
-                    #     now[p.username] = p
-                    # for p in data['players']:
-                    #     if p.username in now:
-                    #         now[p.username] = p 
-                    #     else:
-                    #         self.players.append(p)
+                        # if the mapseed is different from the current seed, then swap in the new map.
+                        if data['map_seed'] != self.map_seed:
+                            # the map is normally already built from the next_map_seed prefetch
+                            print('switching to client map with seed: %d' % data['map_seed'])
+                            self.map = self.map_cache.get(data['map_seed'])
+                            # update seed variable
+                            self.map_seed = data['map_seed']
+
+                        # apply the players data from the server, this also updates the client player in self.player
+                        self.update_players(snapshot)
+
+                        # set the player inputs back to what the player is actually pressing
+                        self.player.inputs = current_inputs
+
+                        # the server position is behind by a round trip, replay what we predicted since
+                        self.reconcile(data['ack_seq'], data['ack_ticks'])
+
+                        # the update timestamp is the server tick the positions are from
+                        self.interpolation.add(data['timestamp'], {player_id: state['location'] for player_id, state in snapshot.items()
+                                                                   if 'location' in state and player_id != self.player.id})
+
+                    # if the server hasn't got our newest inputs, resend them
+                    if data['ack_seq'] < self.input_seq:
+                        log.debug('correcting inputs to: %s', bin(current_inputs))
+                        self.send({'type':'inputs','inputs':current_inputs,'seq':self.input_seq})
+
+                    # build the next round's map in the background while this round plays
+                    self.map_cache.prefetch(data['next_map_seed'])
+
+    def update_players(self, snapshot):
+        '''Apply the player states of a rebuilt server snapshot
+
+        Players already known are updated in place by id, so self.player and
+        the client-side presentation data of the others are kept. Only the
+        players in our area of interest have a location and are drawn.'''
+        self.scoreboard = snapshot
+        known = {p.id: p for p in self.players}
+        known[self.player.id] = self.player
+        players = []
+        for player_id, state in snapshot.items():
+            if 'location' not in state:
+                continue
+            player = known.get(player_id)
+            if player is None:
+                player = Player(list(state['location']), state['username'])
+                player.id = player_id
+            # the other players are moved by the interpolation, only our own player takes the server position
+            if player is self.player:
+                player.location = list(state['location'])
+            player.username = state['username']
+            player.role = state['role']
+            player.speed = ROLE_SPEEDS[player.role]
+            player.score = state['score']
+            player.inputs = state['inputs']
+            player.color = state['color']
+            player.bgcolor = state['bgcolor']
+            players.append(player)
+        self.players = players
+
+    def reconcile(self, ack_seq, ack_ticks):
+        '''Replay the predicted ticks the server hasn't simulated yet on top of its position for our player
+
+        The server has simulated ack_ticks ticks with the inputs numbered
+        ack_seq, any ticks after those were only predicted here.'''
+        history = self.input_history
+        while history and (history[0][0] < ack_seq or (history[0][0] == ack_seq and history[0][1] < ack_ticks)):
+            history.popleft()
+
+        current_inputs = self.player.inputs
+        for seq, _, inputs in history:
+            self.player.inputs = inputs
+            self.predict()
+        self.player.inputs = current_inputs
+
+    def predict(self):
+        '''Move our player by one tick of its inputs'''
+        # the seeker has to wait while the hiders hide, same as in Game.update
+        if not (self.player.role == SEEKER_ROLE and self.state == 'hiding'):
+            self.player.update_location(self.map)
+
+    def interpolate(self):
+        '''Move the other players to where they were INTERPOLATION_DELAY ago'''
+        tick = self.interpolation.render_tick()
+        for player in self.players:
+            if player is not self.player:
+                location = self.interpolation.position(player.id, tick)
+                if location is not None:
+                    player.location = location
 
     def send(self, data):
         '''send data to the server
 
-        expects a dictionary. Will attach the timestamp and pickle the message'''
+        expects a dictionary. Will attach the timestamp and encode the message'''
 
         data['timestamp'] = int((time.time()-self.start_time)*10)
-        msg = pickle.dumps(data)
-        self.socket.sendto(msg, SERVER_ADDRESS)
+        msg = protocol.encode(data)
+        self.socket.sendto(msg, self.server_address)
         
     def login(self, username):
         '''send a login message to the server with the username FIXME DONT SEND PORT NUM'''
@@ -145,45 +262,42 @@ class VisualGame(Game):
                 self.player.handle_event(event)
 
                 # send a message to the server with updated player inputs
-                self.send({'type':'inputs','inputs':self.player.inputs})
+                self.input_seq += 1
+                self.send({'type':'inputs','inputs':self.player.inputs,'seq':self.input_seq})
     
     def draw(self):
         '''draw all elements to the display surface'''
         # black the screen
         self.screen.fill(BACKGROUND_COLOR)
         
-        # create a surface to draw to, it will later be blit to the screen
-        surface = pygame.Surface(SCREEN_SIZE)
+        # the surface to draw to, it will later be blit to the screen
+        surface = self.surface
+
+        # draw the map, the tiles under the camera cover the whole surface
+        # the map is swapped on the network thread, so the layer is rebuilt here when it changes
+        if self.map_layer is None or self.map_layer.walls is not self.map:
+            self.map_layer = MapLayer(self.map)
+        left = int(self.player.location[0] - SCREEN_SIZE[0]/2)
+        top = int(self.player.location[1] - SCREEN_SIZE[1]/2)
+        self.map_layer.blit(surface, left, top)
 
         # draw a small circle at the center of the map (for debugging) 
-        tmp = MAP_CENTER.copy()
-        tmp[0] -= int(self.player.location[0] - SCREEN_SIZE[0]/2)
-        tmp[1] -= int(self.player.location[1] - SCREEN_SIZE[1]/2)
-        pygame.draw.circle(surface, (255,255,255), tmp, 3)
-        
-        # draw the map 
-        # create a camera Frame that will be relative to the map 
-        Frame = np.zeros(SCREEN_SIZE)
-        # adjust the wall positions based on the player location and screen size, then draw the walls to the surface
-        for wall in np.array(self.map):
-            wall[0] -= self.player.location[0] - SCREEN_SIZE[0]/2
-            wall[1] -= self.player.location[1] - SCREEN_SIZE[1]/2
-            wall[2] -= self.player.location[0] - SCREEN_SIZE[0]/2
-            wall[3] -= self.player.location[1] - SCREEN_SIZE[1]/2
-            
-            pygame.draw.line(surface, (255,255,255,255), wall[:2], wall[2:], 3)
+        pygame.draw.circle(surface, (255,255,255), (MAP_CENTER[0] - left, MAP_CENTER[1] - top), 3)
 
         # draw each player along with their names and scores
         for player in self.players:
             if player != self.player:
                 x = int(player.location[0] - self.player.location[0] + SCREEN_SIZE[0]/2)
                 y = int(player.location[1] - self.player.location[1] + SCREEN_SIZE[1]/2)
+                # the server sends players a margin past the screen, skip the ones whose circle and labels are all off it
+                if not (-LABEL_HALF_WIDTH < x < SCREEN_SIZE[0] + LABEL_HALF_WIDTH and -12 < y < SCREEN_SIZE[1] + LABEL_HEIGHT):
+                    continue
 
                 # set the color
-                if player.role == "seeker":
+                if player.role == SEEKER_ROLE:
                     color = SEEKER
                     bgcolor = BGSEEKER
-                elif player.role == "ghost":
+                elif player.role == GHOST_ROLE:
                     color = GHOST
                     bgcolor = BGGHOST
                 else:
@@ -194,19 +308,19 @@ class VisualGame(Game):
                 pygame.draw.circle(surface,color,(x,y), 10)
 
                 # draw usernames and scores above other players
-                text = self.textfont.render(player.username[:10], True, (255,255,255))
+                text = self.text.render(player.username[:10], (255,255,255))
                 text_rect = text.get_rect(center=(x, y-40))
                 surface.blit(text,text_rect)
 
-                text = self.textfont.render(str(player.score), True, (255,255,255))
+                text = self.text.render(str(player.score), (255,255,255))
                 text_rect = text.get_rect(center=(x, y-20))
                 surface.blit(text,text_rect)
         
         # set the player color
-        if self.player.role == "seeker":
+        if self.player.role == SEEKER_ROLE:
             color = SEEKER
             bgcolor = BGSEEKER
-        elif self.player.role == "ghost":
+        elif self.player.role == GHOST_ROLE:
             color = GHOST
             bgcolor = BGGHOST
         else:
@@ -217,16 +331,16 @@ class VisualGame(Game):
         pygame.draw.circle(surface,color,tuple(map(int,(SCREEN_SIZE[0]/2, SCREEN_SIZE[1]/2))), 10)
 
         # draw usernames and score above this player
-        text = self.textfont.render(self.player.username[:6], True, (255,255,255))
+        text = self.text.render(self.player.username[:6], (255,255,255))
         text_rect = text.get_rect(center=(SCREEN_SIZE[0]/2, SCREEN_SIZE[1]/2 - 40))
         surface.blit(text,text_rect)
 
-        text = self.textfont.render(str(self.player.score), True, (255,255,255))
+        text = self.text.render(str(self.player.score), (255,255,255))
         text_rect = text.get_rect(center=(SCREEN_SIZE[0]/2, SCREEN_SIZE[1]/2 - 20))
         surface.blit(text,text_rect)
 
         # draw game state
-        text = self.textfont.render(self.state.upper(), True, (0,0,255))
+        text = self.text.render(self.state.upper(), (0,0,255))
         text_rect = text.get_rect(center=(SCREEN_SIZE[0]/2, 60))
         surface.blit(text,text_rect)
 
@@ -236,11 +350,23 @@ class VisualGame(Game):
         # update the display
         pygame.display.update()
     
+    def tick(self, tick):
+        '''Advance the game by one tick, remembering our inputs to replay them on the next update'''
+        with self.lock:
+            if self.input_seq != self.predicted_seq:
+                self.predicted_seq = self.input_seq
+                self.predicted_ticks = 0
+            self.input_history.append((self.input_seq, self.predicted_ticks, self.player.inputs))
+            self.predicted_ticks += 1
+            # only our own player is simulated, the others are interpolated from the server updates
+            self.predict()
+
     # repeat for the duration of the game. 
     def main_loop(self):
         '''main control loop'''
         while not self.done:
             self.event_loop()
-            self.update()
+            self.timestep.run(self.tick)
+            self.interpolate()
             self.draw()
-            self.clock.tick(self.fps)
+            time.sleep(self.timestep.until_next())